@@ -3,11 +3,95 @@
 
 import sublime
 import sublime_plugin
-from win32com.client import Dispatch
 import os
 import threading
-import pythoncom
 import re
+import bisect
+from array import array
+import concurrent.futures
+import json
+import hashlib
+import collections
+import time
+import itertools
+from .mv_codec import AM, VM, SVM, OUTPUT_TABLE, DISPLAY_TABLE, mv_translate, encode_item, decode_item, item_matches
+from .text_diff import split_lines, line_diff
+
+
+# Text of items waiting to be inserted into a view, keyed by view id. Large items are kept here instead
+# of being passed through command arguments (see <replace_view_text>).
+pending_view_text = {}
+
+
+# Class: DynamicArray
+# Index of the attribute, value and subvalue marks in an MV item. The item is scanned once and the mark 
+# positions are kept in compact arrays, fields are then located with a binary search so extracting 
+# <a,v,s> does not depend on the size of the item.
+# 
+# Fields are numbered from 1, a number of 0 refers to the enclosing field (e.g. bounds(3) is all of 
+# attribute 3).
+class DynamicArray:
+    # Function: __init__
+    # Parameters:
+    #   text - String containing the item.
+    #   am - Attribute delimiter (defaults to <AM>, use '\n' for an item converted with <decode_item>).
+    def __init__(self, text, am=AM):
+        self.am = am
+        self.index(text)
+
+    # Function: index
+    # Replace the item text and rebuild the mark positions.
+    def index(self, text):
+        self.text = text
+        self.marks = {self.am: array('L'), VM: array('L'), SVM: array('L')}
+        for match in re.finditer('[' + re.escape(self.am) + VM + SVM + ']', text):
+            self.marks[match.group()].append(match.start())
+
+    # Function: field_bounds
+    # Returns the (start, end) of the nth field between start and end, None if there are fewer than n fields.
+    def field_bounds(self, positions, start, end, n):
+        first = bisect.bisect_left(positions, start)
+        last = bisect.bisect_left(positions, end)
+        count = last - first + 1
+        if n < 1 or n > count: return None
+        return (start if n == 1 else positions[first + n - 2] + 1, end if n == count else positions[first + n - 1])
+
+    # Function: bounds
+    # Returns the (start, end) of <a,v,s> in the item text, None if the field does not exist.
+    def bounds(self, a=0, v=0, s=0):
+        span = (0, len(self.text))
+        for (n, mark) in ((a, self.am), (v, VM), (s, SVM)):
+            if n == 0 or span == None: break
+            span = self.field_bounds(self.marks[mark], span[0], span[1], n)
+        return span
+
+    # Function: count
+    # Returns the number of attributes in the item, values in attribute a, or subvalues in value <a,v>.
+    def count(self, a=0, v=0):
+        span = self.bounds(a, v)
+        if span == None: return 0
+        positions = self.marks[(self.am, VM, SVM)[(a > 0) + (v > 0)]]
+        return bisect.bisect_left(positions, span[1]) - bisect.bisect_left(positions, span[0]) + 1
+
+    # Function: extract
+    # Returns the contents of <a,v,s>, an empty string if the field does not exist.
+    def extract(self, a=0, v=0, s=0):
+        span = self.bounds(a, v, s)
+        return self.text[span[0]:span[1]] if span else ''
+
+    # Function: replace
+    # Replace the contents of <a,v,s>. Missing fields are added the same way as a BASIC REPLACE.
+    def replace(self, a, v, s, value):
+        key = ()
+        for (n, mark) in ((a, self.am), (v, VM), (s, SVM)):
+            if n == 0: break
+            count = self.count(*key)
+            if n > count:
+                end = self.bounds(*key)[1]
+                self.index(self.text[:end] + mark * (n - count) + self.text[end:])
+            key += (n,)
+        (start, end) = self.bounds(a, v, s)
+        self.index(self.text[:start] + value + self.text[end:])
 
 
 # Function: log_output
@@ -30,21 +114,75 @@ def log_output(window, output_text, panel_name='AccuTermClient'):
     window.run_command('show_panel', {'panel': 'output.' + panel_name})
 
 
+# COM modules, imported on first use by <import_com> so loading the plugin does not wait on COM.
+pythoncom = None
+Dispatch = None
+
+
+# Function: import_com
+# Imports the COM modules used to talk to AccuTerm if they have not been imported yet.
+def import_com():
+    global pythoncom, Dispatch
+    if Dispatch == None:
+        start_time = time.time()
+        import pythoncom
+        from win32com.client import Dispatch
+        print('AccuTermClient: COM imported in ' + str(int((time.time() - start_time) * 1000)) + ' ms')
+
+
+# Function: co_initialize
+# Initialises COM for the current thread, required before connecting. COM may have been imported on any 
+# thread so every thread is initialised, repeated calls on the same thread are harmless. Called by <connect>.
+def co_initialize():
+    import_com()
+    pythoncom.CoInitialize()
+
+
+# Time before which <connect> will not try to reach AccuTerm again after a failed connection.
+connect_retry_time = 0
+
+
+# Class: OfflineServer
+# Stand-in for the AccuTerm Server object returned by <connect> while AccuTerm can not be reached.
+class OfflineServer:
+    LastError = -1
+    LastErrorMessage = 'Not connected to AccuTerm'
+    MDName = ''
+
+    def __bool__(self):
+        return False
+
+    def IsConnected(self):
+        return False
+
+    def Disconnect(self):
+        pass
+
+
 # Function: connect
-# Connects to an AccuTerm session running the FTSERVER and returns the AccuTerm Server object. 
+# Connects to an AccuTerm session running the FTSERVER and returns the AccuTerm Server object. After a failed 
+# connection no further attempts are made for connect_retry_interval seconds and an <OfflineServer> is 
+# returned instead, so commands fail fast rather than each waiting for the connection to time out.
 # 
 # Parameters:
 #   panel_name - Name of the output panel to send error messages to (Defaults to AccuTermClient).
+#   log_errors - Show an error in the output panel if the connection fails (Defaults to True).
 # 
 # Returns:
 #   object - AccuTerm Server object.
-def connect(panel_name='AccuTermClient'):
+def connect(panel_name='AccuTermClient', log_errors=True):
+    global connect_retry_time
+    if time.time() < connect_retry_time:
+        if log_errors: log_output(sublime.active_window(), 'Not connected to AccuTerm, retrying in ' + str(int(connect_retry_time - time.time()) + 1) + ' seconds.', panel_name)
+        return OfflineServer()
+    co_initialize()
     mv_svr = Dispatch('atPickServer.Server')
     if mv_svr.Connect():
         # log_output(sublime.active_window(), 'Connected', panel_name) # Ideally the connecct would be passed the window but this is intended for debugging only.
-        pass
+        connect_retry_time = 0
     else: 
-        log_output(sublime.active_window(), 'Unable to connect to AccuTerm\nMake sure AccuTerm is running FTSERVER.', panel_name)
+        connect_retry_time = time.time() + sublime.load_settings('AccuTermClient.sublime-settings').get('connect_retry_interval', 30)
+        if log_errors: log_output(sublime.active_window(), 'Unable to connect to AccuTerm\nMake sure AccuTerm is running FTSERVER.', panel_name)
     return mv_svr
 
 
@@ -138,12 +276,24 @@ def get_file_item(view):
             file_name = ''.join([view.settings().get('default_dir', ''), os.sep, view.name()])
     if not bool(file_name): return (None, None)
     mv_file = file_name.split(os.sep)[-2]
-    mv_item = file_name.split(os.sep)[-1] 
-    remove_file_ext = sublime.load_settings('AccuTermClient.sublime-settings').get('remove_file_extensions')
-    if os.path.splitext(mv_item.lower())[1][1:] in remove_file_ext: mv_item = os.path.splitext(mv_item)[0]
+    mv_item = get_item_name(file_name.split(os.sep)[-1])
     return (mv_file, mv_item)
 
 
+# Function: get_item_name
+# Gets the MV item ID from a local file name by removing the file extension (see remove_file_extensions setting).
+# 
+# Parameters:
+#   file_name - Local file name without the directory.
+# 
+# Returns:
+#   string - MV item ID.
+def get_item_name(file_name):
+    remove_file_ext = sublime.load_settings('AccuTermClient.sublime-settings').get('remove_file_extensions')
+    if os.path.splitext(file_name.lower())[1][1:] in remove_file_ext: file_name = os.path.splitext(file_name)[0]
+    return file_name
+
+
 # Function: get_filename
 # Get the windows pathname from the MV file item reference.
 # 
@@ -164,11 +314,12 @@ def get_filename(window, mv_file, mv_item):
 # Gets the base pathname froM a Sublime window object.
 # 
 # Parameters:
-#   window - Sublime window object.
+#   window - Sublime window object (defaults to the active window).
 # 
 # Returns:
 #   string - Windows pathname.
-def get_base_path(window=sublime.active_window()):
+def get_base_path(window=None):
+    if window == None: window = sublime.active_window()
     project_file_name = window.project_file_name()
     base_path = os.path.expandvars(
         sublime.load_settings('AccuTermClient.sublime-settings').get('default_save_location', '%userprofile%')
@@ -217,6 +368,133 @@ def find_view(view_name):
                 return view
     return None
 
+# Function: fingerprint
+# Returns a fingerprint of item data used to tell if an item has changed.
+def fingerprint(data):
+    return hashlib.md5(data.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+# Class: ItemCache
+# Bounded cache of items read from the MV server, used by <download> to show items without waiting for the 
+# MV server. Items likely to be opened next are read by a background thread (see <prefetch>) and the least 
+# recently used items are evicted once the prefetch_cache_items or prefetch_cache_size settings are exceeded.
+# Items larger than the large_item_size setting are not cached, so large items are not held twice.
+# A cached item is never trusted as current, it is validated by <open_cached_item>.
+class ItemCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.items = collections.OrderedDict()
+        self.size = 0
+        self.queue = collections.deque()
+        self.worker = None
+
+    # Function: get
+    # Returns the cache entry (data, fingerprint, host type) for an item, None if the item is not cached.
+    def get(self, mv_file, mv_item):
+        with self.lock:
+            entry = self.items.get((mv_file, mv_item), None)
+            if entry != None: self.items.move_to_end((mv_file, mv_item))
+            return entry
+
+    # Function: put
+    # Add an item to the cache, evicting the least recently used items if the cache is full.
+    def put(self, mv_file, mv_item, data, host_type=None):
+        settings = sublime.load_settings('AccuTermClient.sublime-settings')
+        max_items = settings.get('prefetch_cache_items', 64)
+        max_size = settings.get('prefetch_cache_size', 8388608)
+        with self.lock:
+            self.remove((mv_file, mv_item))
+            if max_items < 1 or len(data) > max_size or len(data) > settings.get('large_item_size', 1048576): return
+            self.items[(mv_file, mv_item)] = (data, fingerprint(data), host_type)
+            self.size += len(data)
+            while len(self.items) > max_items or self.size > max_size:
+                self.remove(next(iter(self.items)))
+
+    def remove(self, key):
+        entry = self.items.pop(key, None)
+        if entry != None: self.size -= len(entry[0])
+
+    # Function: discard
+    # Remove an item from the cache, used when the item is written to the MV server.
+    def discard(self, mv_file, mv_item):
+        with self.lock:
+            self.remove((mv_file, mv_item))
+
+    # Function: prefetch
+    # Queue items to be read into the cache by a background thread. The most recently queued items are read 
+    # first.
+    # 
+    # Parameters:
+    #   items - List of (mv_file, mv_item) in order of priority.
+    def prefetch(self, items):
+        max_items = sublime.load_settings('AccuTermClient.sublime-settings').get('prefetch_cache_items', 64)
+        with self.lock:
+            for key in reversed(items):
+                if key in self.queue: self.queue.remove(key)
+                if key not in self.items: self.queue.append(key)
+            while len(self.queue) > max_items: self.queue.popleft()
+            if self.queue and self.worker == None:
+                self.worker = threading.Thread(target=self.run_worker)
+                self.worker.daemon = True
+                self.worker.start()
+
+    def run_worker(self):
+        co_initialize()
+        mv_svr = connect(log_errors=False)
+        host_type = getHostType(mv_svr) if mv_svr.IsConnected() else None
+        while True:
+            with self.lock:
+                if not self.queue or host_type == None:
+                    self.queue.clear()
+                    self.worker = None
+                    break
+                (mv_file, mv_item) = self.queue.pop()
+                if (mv_file, mv_item) in self.items: continue
+            data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
+            if mv_svr.LastError == 0: self.put(mv_file, mv_item, data, host_type)
+        if host_type != None: mv_svr.Disconnect()
+
+
+item_cache = ItemCache()
+
+
+# Function: prefetch_targets
+# Queue the CALL and INCLUDE targets of the item in a view to be read into the <ItemCache>.
+def prefetch_targets(view):
+    (mv_file, mv_item) = get_file_item(view)
+    if not mv_file or not mv_item: return
+    index_view(view)
+    item_cache.prefetch(symbol_index.targets(mv_file, mv_item, ('call', 'include')))
+
+
+# Function: read_item
+# Read an item from the MV server, locking it if requested. If the item is locked by another port the user 
+# is asked to read it without a lock.
+# 
+# Parameters:
+#   mv_svr - AccuTerm server object (see <connect>).
+#   mv_file - Filename on MV server.
+#   mv_item - Item ID on MV server.
+#   readu_flag - Lock the item on the MV server (defaults to the open_with_readu setting).
+# 
+# Returns:
+#   tuple - [0] Item data.
+# 
+#           [1] True if the item was locked.
+def read_item(mv_svr, mv_file, mv_item, readu_flag=None):
+    if readu_flag == None: readu_flag = sublime.load_settings('AccuTermClient.sublime-settings').get('open_with_readu', True)
+    if readu_flag:
+        mv_svr.UnlockItem(mv_file, mv_item)
+        data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 1)
+        if mv_svr.LastError == 260 and \
+        sublime.ok_cancel_dialog( mv_file + ' ' + mv_item + ' is locked by another port. Do you want to open this as read-only (without a lock)?', ok_title='Yes'):
+            data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
+            readu_flag = False
+    else:
+        data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
+    return (data, readu_flag)
+
+
 # Function: download
 # Download item from MV server into a Sublime view.
 # 
@@ -230,43 +508,18 @@ def find_view(view_name):
 def download(window, mv_file, mv_item, file_name=None, readu_flag=None):
     if bool(mv_file) and bool(mv_item):
         if not file_name: file_name = get_filename(window, mv_file, mv_item)
+        cached = item_cache.get(mv_file, mv_item)
+        if cached:
+            open_cached_item(window, mv_file, mv_item, file_name, readu_flag, cached)
+            return
         mv_svr = connect()
         if mv_svr:
             if bool( mv_svr.ItemExists(mv_file, mv_item) ):
-                mv_syntaxes = sublime.load_settings('AccuTermClient.sublime-settings').get('syntax_file_locations', {})
-
-                if readu_flag == None: readu_flag = sublime.load_settings('AccuTermClient.sublime-settings').get('open_with_readu', True)
-                if readu_flag:
-                    mv_svr.UnlockItem(mv_file, mv_item)
-                    data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 1)
-                    if mv_svr.LastError == 260 and \
-                    sublime.ok_cancel_dialog( mv_file + ' ' + mv_item + ' is locked by another port. Do you want to open this as read-only (without a lock)?', ok_title='Yes'):
-                        data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
-                        readu_flag = False
-                else:
-                    data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
-
+                (data, readu_flag) = read_item(mv_svr, mv_file, mv_item, readu_flag)
                 if check_error_message(window, mv_svr, 'Download success'):
-                    new_view = find_view(file_name)
-                    if new_view == None:
-                        new_view = window.new_file()
-                        new_view.set_name( os.path.split(get_filename(window, mv_file, mv_item))[1] )
-                        new_view.sel().clear()
-                        default_dir = get_base_path(window) + os.sep + mv_file
-                        if not os.path.exists(default_dir): os.makedirs(default_dir)
-                        new_view.settings().set('default_dir', default_dir)
-                        host_type = getHostType(mv_svr)
-                        if host_type in mv_syntaxes: new_view.set_syntax_file(mv_syntaxes[host_type])
-                    new_view.settings().set('AccuTermClient_mv_file_item', [mv_file, mv_item])
-                    new_view.settings().set('AccuTermClient_sync_state', 'skip')
-                    if readu_flag:
-                        new_view.settings().set('AccuTermClient_lock_state', 'locked')
-                    else:
-                        new_view.settings().set('AccuTermClient_lock_state', 'no_locking')
-                    new_view.run_command('accu_term_replace_file', {"text": data})
-                    if new_view.substr(sublime.Region(0,2)).upper() == 'PQ':
-                        new_view.set_syntax_file(mv_syntaxes['PROC'])
-                    new_view.set_status('AccuTermClient_lock_state', new_view.settings().get('AccuTermClient_lock_state', ''))
+                    host_type = getHostType(mv_svr)
+                    item_cache.put(mv_file, mv_item, data, host_type)
+                    show_item(window, mv_file, mv_item, file_name, data, readu_flag, lambda: host_type)
             else: 
                 log_output(window, mv_file + ' ' + mv_item + ' not found.')
             mv_svr.Disconnect()
@@ -274,31 +527,339 @@ def download(window, mv_file, mv_item, file_name=None, readu_flag=None):
         log_output(window, 'Invalid Input: ' + str(mv_file) + ' ' + str(mv_item) + ' (Must be [file] [item])')
 
 
+# Function: show_item
+# Show an item from the MV server in a Sublime view, creating the view if the item is not already open.
+# 
+# Parameters:
+#   window - Sublime window object.
+#   mv_file - Filename on MV server.
+#   mv_item - Item ID on MV server.
+#   file_name - Local file name of the item.
+#   data - Item data as returned by Readitem.
+#   readu_flag - True if the item is locked on the MV server.
+#   get_host_type - Function returning the MV host type, only called when a new view is created.
+# 
+# Returns:
+#   view - Sublime view object.
+def show_item(window, mv_file, mv_item, file_name, data, readu_flag, get_host_type):
+    mv_syntaxes = sublime.load_settings('AccuTermClient.sublime-settings').get('syntax_file_locations', {})
+    new_view = find_view(file_name)
+    if new_view == None:
+        new_view = window.new_file()
+        new_view.set_name( os.path.split(get_filename(window, mv_file, mv_item))[1] )
+        new_view.sel().clear()
+        default_dir = get_base_path(window) + os.sep + mv_file
+        if not os.path.exists(default_dir): os.makedirs(default_dir)
+        new_view.settings().set('default_dir', default_dir)
+        host_type = get_host_type()
+        if host_type in mv_syntaxes: new_view.set_syntax_file(mv_syntaxes[host_type])
+    new_view.settings().set('AccuTermClient_mv_file_item', [mv_file, mv_item])
+    new_view.settings().set('AccuTermClient_sync_state', 'skip')
+    if readu_flag:
+        new_view.settings().set('AccuTermClient_lock_state', 'locked')
+    else:
+        new_view.settings().set('AccuTermClient_lock_state', 'no_locking')
+    new_view.settings().set('AccuTermClient_fingerprint', fingerprint(replace_view_text(new_view, data, mv_file + ' ' + mv_item)))
+    if new_view.substr(sublime.Region(0,2)).upper() == 'PQ':
+        new_view.set_syntax_file(mv_syntaxes['PROC'])
+    new_view.set_status('AccuTermClient_lock_state', new_view.settings().get('AccuTermClient_lock_state', ''))
+    sublime.set_timeout_async(lambda: prefetch_targets(new_view), 0)
+    return new_view
+
+
+# Function: open_cached_item
+# Show an item from the <ItemCache> and then validate it against the MV server. The view is read only until 
+# the item has been read from the MV server (with a lock if requested), if the fingerprint of the item on 
+# the server differs from the cached copy the view is replaced with the item from the server.
+# 
+# Parameters:
+#   window - Sublime window object.
+#   mv_file - Filename on MV server.
+#   mv_item - Item ID on MV server.
+#   file_name - Local file name of the item.
+#   readu_flag - Lock the item on the MV server (defaults to the open_with_readu setting).
+#   cached - Cache entry (see <ItemCache.get>).
+# 
+# Returns:
+#   None
+def open_cached_item(window, mv_file, mv_item, file_name, readu_flag, cached):
+    (cached_data, cached_fingerprint, host_type) = cached
+    view = show_item(window, mv_file, mv_item, file_name, cached_data, False, lambda: host_type)
+    view.settings().set('AccuTermClient_verifying', True)
+    view.set_read_only(True)
+    view.set_status('AccuTermClient_cache', 'Verifying with MV server')
+
+    def validate():
+        co_initialize()
+        verified = False
+        mv_svr = connect()
+        if mv_svr.IsConnected():
+            (data, locked) = read_item(mv_svr, mv_file, mv_item, readu_flag)
+            if check_error_message(window, mv_svr, 'Download success'):
+                verified = True
+                if fingerprint(data) != cached_fingerprint:
+                    item_cache.put(mv_file, mv_item, data, host_type)
+                    view.set_read_only(False)
+                    view.settings().set('AccuTermClient_fingerprint', fingerprint(replace_view_text(view, data, mv_file + ' ' + mv_item)))
+                    view.settings().set('AccuTermClient_sync_state', 'skip')
+                view.settings().set('AccuTermClient_lock_state', 'locked' if locked else 'no_locking')
+                view.set_status('AccuTermClient_lock_state', view.settings().get('AccuTermClient_lock_state', ''))
+            else:
+                item_cache.discard(mv_file, mv_item)
+            mv_svr.Disconnect()
+        view.settings().erase('AccuTermClient_verifying')
+        if verified:
+            if view.id() not in pending_view_text: view.set_read_only(False)
+            view.erase_status('AccuTermClient_cache')
+        else:
+            view.set_status('AccuTermClient_cache', 'Not verified with MV server (read only)')
+    sublime.set_timeout_async(validate, 0)
+
+
+# Function: replace_view_text
+# Replace the contents of a view with the text of an item from the MV server. Line endings are converted 
+# in a single pass. Items larger than the large_item_size setting are not serialised through command 
+# arguments, they are held in <pending_view_text> and inserted by <AccuTermInsertPendingCommand>. The view 
+# is read only and the loading is shown in the status bar until the item has been inserted.
+# 
+# Parameters:
+#   view - Sublime view object.
+#   text - String containing the item from the MV server.
+#   caption - Name shown in the status bar while a large item is loading (defaults to the view name).
+# 
+# Returns:
+#   string - The converted text.
+def replace_view_text(view, text, caption=None):
+    text = decode_item(text)
+    settings = sublime.load_settings('AccuTermClient.sublime-settings')
+    if len(text) <= settings.get('large_item_size', 1048576):
+        view.run_command('accu_term_replace_file', {"text": text})
+    else:
+        read_only = pending_view_text[view.id()][2] if view.id() in pending_view_text else view.is_read_only()
+        serial = id(text)
+        caption = caption if caption else view.name()
+        pending_view_text[view.id()] = (text, caption, read_only, serial)
+        view.set_read_only(True)
+        # The insert is run from a timeout so the status bar is painted before Sublime is busy inserting.
+        view.set_status('AccuTermClient_progress', 'Loading ' + caption + ' (' + str(len(text) // 1024) + ' KB)')
+        sublime.set_timeout(lambda: view.run_command('accu_term_insert_pending', {"serial": serial}), 0)
+    return text
+
+
 # Function: upload
-# Upload the contents of a view to the MV server.
+# Upload the contents of a view to the MV server. If the MV server can not be reached the upload is added 
+# to the <WriteBackQueue> and written once the connection is back.
 # 
 # Parameters:
 #   view - Sublime view object.
 #   mv_server - AccuTerm server object (optional).
+#   data - Contents of the view already converted with <encode_item> (optional).
 # 
 # Returns:
 #   string - Error message, empty for success.
-def upload(view, mv_svr=None):
-    if not mv_svr: mv_svr = connect()
+def upload(view, mv_svr=None, data=None):
     (mv_file, mv_item) = get_file_item(view)
-    data = view.substr( sublime.Region(0, view.size()) ).replace('\n', '\xFE')
+    if is_data_item_view(view):
+        log_output(view.window() if view.window() else sublime.active_window(), 
+            mv_file + ' ' + mv_item + ' is open as a data item and can not be uploaded, use Edit Field to change it.')
+        return -1
+    if not mv_svr: mv_svr = connect()
+    if data == None: data = encode_item(view.substr( sublime.Region(0, view.size()) ))
+    lock_flag = 1 if get_view_lock_state(view) == 'locked' else 0
+    try:
+        if mv_svr.IsConnected(): mv_svr.WriteItem(mv_file, mv_item, data, 0, 0, 0, lock_flag)
+    except Exception: # The connection to AccuTerm was lost.
+        mv_svr = OfflineServer()
     if mv_svr.IsConnected():
-        if get_view_lock_state(view) == 'locked':
-            mv_svr.WriteItem(mv_file, mv_item, data, 0, 0, 0, 1)
-        else:
-            mv_svr.WriteItem(mv_file, mv_item, data, 0, 0, 0, 0)
-        check_error_message(view.window(), mv_svr, 'Uploaded to ' + mv_file + ' ' + mv_item)
+        item_cache.discard(mv_file, mv_item)
+        if check_error_message(view.window(), mv_svr, 'Uploaded to ' + mv_file + ' ' + mv_item):
+            view.settings().set('AccuTermClient_fingerprint', fingerprint(view.substr( sublime.Region(0, view.size()) )))
+            write_back_queue.discard(mv_file, mv_item)
         view.settings().set('AccuTermClient_sync_state', 'check')
+    else:
+        write_back_queue.add(view, mv_file, mv_item, data, lock_flag)
     return mv_svr.LastError
 
 
+# Class: WriteBackQueue
+# Uploads made while the MV server can not be reached. The queue is saved to the Sublime cache folder after 
+# every change so it survives restarting Sublime. Uploads of the same item are coalesced so only the latest 
+# contents are written. The queue is written by <flush> once AccuTerm can be reached again, items that have 
+# changed on the MV server since they were downloaded are only overwritten if the user agrees.
+# 
+# Each entry holds the item data, the lock flag, the fingerprint of the item when it was downloaded or last 
+# matched the server in <check_sync> (base, None if neither happened) and the fingerprint of the queued 
+# contents (local).
+class WriteBackQueue:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = None
+        self.flush_pending = False
+
+    def get_path(self):
+        return os.path.join(sublime.cache_path(), 'AccuTermClient', 'write_back_queue.json')
+
+    # Function: load
+    # Read the journal the first time the queue is used, showing the queue depth and scheduling a flush for 
+    # uploads queued in an earlier session.
+    def load(self):
+        with self.lock:
+            if self.entries != None: return
+            try:
+                with open(self.get_path(), encoding='utf-8') as file:
+                    self.entries = collections.OrderedDict( (entry['file'] + '\t' + entry['item'], entry) for entry in json.load(file) )
+            except (IOError, OSError, ValueError):
+                self.entries = collections.OrderedDict()
+            for entry in self.entries.values(): entry.pop('failed', None)
+            if self.entries: self.schedule_flush()
+        self.update_status()
+
+    # Function: save
+    # Write the queue to a temporary file and then replace the journal, so a failed write can not lose the queue.
+    def save(self):
+        with self.lock:
+            if not os.path.exists(os.path.dirname(self.get_path())): os.makedirs(os.path.dirname(self.get_path()))
+            with open(self.get_path() + '.tmp', 'w', encoding='utf-8') as file:
+                json.dump(list(self.entries.values()), file)
+            os.replace(self.get_path() + '.tmp', self.get_path())
+        self.update_status()
+
+    def depth(self):
+        self.load()
+        return len(self.entries)
+
+    # Function: add
+    # Queue the contents of a view to be written to the MV server.
+    # 
+    # Parameters:
+    #   view - Sublime view object.
+    #   mv_file - Filename on MV server.
+    #   mv_item - Item ID on MV server.
+    #   data - Item data converted with <encode_item>.
+    #   lock_flag - 1 to keep the item locked when it is written.
+    def add(self, view, mv_file, mv_item, data, lock_flag):
+        self.load()
+        key = mv_file + '\t' + mv_item
+        with self.lock:
+            base = self.entries[key]['base'] if key in self.entries else view.settings().get('AccuTermClient_fingerprint', None)
+            self.entries.pop(key, None)
+            self.entries[key] = {'file': mv_file, 'item': mv_item, 'data': data, 'lock': lock_flag, 'base': base,
+                'local': fingerprint(view.substr(sublime.Region(0, view.size())))}
+            self.save()
+        log_output(view.window() if view.window() else sublime.active_window(), 
+            'Unable to reach the MV server, ' + mv_file + ' ' + mv_item + ' will be uploaded when the connection is back.')
+        self.schedule_flush()
+
+    # Function: discard
+    # Remove an item from the queue, used when the item has been written to the MV server.
+    def discard(self, mv_file, mv_item):
+        self.load()
+        with self.lock:
+            if self.entries.pop(mv_file + '\t' + mv_item, None) != None: self.save()
+
+    def schedule_flush(self):
+        with self.lock:
+            if self.flush_pending: return
+            self.flush_pending = True
+        interval = sublime.load_settings('AccuTermClient.sublime-settings').get('connect_retry_interval', 30)
+        sublime.set_timeout_async(self.flush, interval * 1000)
+
+    # Function: flush
+    # Write the queued items to the MV server, retrying later if AccuTerm can not be reached. Items that fail 
+    # to write are parked (see <write>) and the remaining items are still written.
+    def flush(self):
+        with self.lock:
+            self.flush_pending = False
+            if not self.entries: return
+        co_initialize()
+        mv_svr = connect(log_errors=False)
+        if not mv_svr.IsConnected():
+            self.schedule_flush()
+            return
+        window = sublime.active_window()
+        for key in list(self.entries.keys()):
+            with self.lock:
+                entry = self.entries.get(key, None)
+            if entry == None or entry.get('failed'): continue
+            try:
+                if not self.write(window, mv_svr, entry): break
+            except Exception: # The connection to AccuTerm was lost again.
+                break
+        mv_svr.Disconnect()
+        if self.waiting(): self.schedule_flush()
+
+    # Function: write
+    # Write a queued item to the MV server after checking that the item has not changed on the server. If the 
+    # item can not be read or written (e.g. it is locked by another port) the error is shown and the entry is 
+    # parked, it is retried when the item is uploaded again or the next time Sublime starts.
+    # 
+    # Returns:
+    #   bool - False if the connection failed and the remaining items should be retried later.
+    def write(self, window, mv_svr, entry):
+        (mv_file, mv_item) = (entry['file'], entry['item'])
+        if bool( mv_svr.ItemExists(mv_file, mv_item) ):
+            server_fingerprint = fingerprint(decode_item(mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)))
+            if mv_svr.LastError: return self.park(window, mv_svr, entry)
+            if entry['base'] == None:
+                prompt = mv_file + ' ' + mv_item + ' on the MV server differs from the changes queued while offline and it can not be told whether it has changed since it was opened. Do you want to overwrite it?'
+            else:
+                prompt = mv_file + ' ' + mv_item + ' has changed on the MV server since it was downloaded. Do you want to overwrite it with the changes queued while offline?'
+            if server_fingerprint not in [entry['base'], entry['local']] and not sublime.ok_cancel_dialog(prompt, 'Overwrite'):
+                log_output(window, 'Queued upload of ' + mv_file + ' ' + mv_item + ' was not written, the local copy has not been changed.')
+                self.discard(mv_file, mv_item)
+                return True
+        mv_svr.WriteItem(mv_file, mv_item, entry['data'], 0, 0, 0, entry['lock'])
+        if not check_error_message(window, mv_svr, 'Uploaded queued changes to ' + mv_file + ' ' + mv_item): return self.park(window, mv_svr, entry)
+        item_cache.discard(mv_file, mv_item)
+        with self.lock:
+            if self.entries.get(mv_file + '\t' + mv_item, None) is entry: self.discard(mv_file, mv_item)
+        for view in [ view for window in sublime.windows() for view in window.views() if get_file_item(view) == (mv_file, mv_item) ]:
+            view.settings().set('AccuTermClient_fingerprint', entry['local'])
+        return True
+
+    # Function: park
+    # Mark a queued item that the MV server refused so it is skipped by <flush>, unless the connection was lost.
+    # 
+    # Returns:
+    #   bool - False if the connection failed, True if the item was parked.
+    def park(self, window, mv_svr, entry):
+        if not mv_svr.IsConnected(): return False
+        log_output(window, 'Queued upload of ' + entry['file'] + ' ' + entry['item'] + ' failed: ' + str(mv_svr.LastError) + ' ' + mv_svr.LastErrorMessage + 
+            '\nIt will be retried when the item is uploaded again or Sublime is restarted.')
+        with self.lock:
+            entry['failed'] = mv_svr.LastErrorMessage
+            self.save()
+        return True
+
+    # Function: waiting
+    # Returns the number of queued items that have not been parked.
+    def waiting(self):
+        self.load()
+        with self.lock:
+            return len([ entry for entry in self.entries.values() if not entry.get('failed') ])
+
+    # Function: show_status
+    # Show the number of queued uploads in the status bar of a view. Nothing is shown until the queue has been 
+    # loaded (see <plugin_loaded>), so activating views during startup does not read the journal.
+    def show_status(self, view):
+        if self.entries == None: return
+        if self.depth():
+            failed = self.depth() - self.waiting()
+            view.set_status('AccuTermClient_write_back', 'MV upload queue: ' + str(self.depth()) + (' (' + str(failed) + ' failed)' if failed else ''))
+        else:
+            view.erase_status('AccuTermClient_write_back')
+
+    def update_status(self):
+        for window in sublime.windows():
+            for view in window.views(): self.show_status(view)
+
+
+write_back_queue = WriteBackQueue()
+
+
 # Function: check_sync
-# Compare the contents of a view against the corresponding item on the MV server.
+# Compare the contents of a view against the corresponding item on the MV server. If they differ the user can 
+# download a fresh copy or compare the copies with <show_item_diff>.
 # 
 # Parameters:
 #   view - Sublime view object.
@@ -321,12 +882,19 @@ def check_sync(view, mv_svr=None):
         (mv_file, mv_item) = get_file_item(view)
         if not mv_svr: mv_svr = connect()
         if mv_svr.IsConnected() and bool( mv_svr.ItemExists(mv_file, mv_item) ):
-            data_mv = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0).replace('\r', '')
+            data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
             data_local = view.substr( sublime.Region(0, view.size()) )
-            if data_mv != data_local:  
-                prompt = mv_file + ' ' + mv_item + ' has changed on the MV server. Do you want to download a fresh copy?'
-                if sublime.ok_cancel_dialog(prompt, 'Download'):
+            if item_matches(data, data_local):
+                # Record a base for the <WriteBackQueue> if the item was not downloaded, hashing is skipped otherwise.
+                if not view.settings().get('AccuTermClient_fingerprint'): view.settings().set('AccuTermClient_fingerprint', fingerprint(data_local))
+            else:
+                data_mv = decode_item(data)
+                prompt = mv_file + ' ' + mv_item + ' has changed on the MV server. Do you want to download a fresh copy or compare it with the local copy?'
+                choice = sublime.yes_no_cancel_dialog(prompt, 'Download', 'Compare')
+                if choice == sublime.DIALOG_YES:
                     view.run_command('accu_term_refresh')
+                elif choice == sublime.DIALOG_NO:
+                    show_item_diff(view, data_mv)
     return sync_state
 
 # Function: expand_mv_command
@@ -341,25 +909,110 @@ def check_sync(view, mv_svr=None):
 # Expansion Variables:
 #   ${FILE} - MV File of active local file.
 #   ${ITEM} - MV item ID of active local file.
-def expand_mv_command(command, mv_file='', mv_item=''):
+#   ${PATTERN} - Text to search for (see <AccuTermSearchCommand>).
+def expand_mv_command(command, mv_file='', mv_item='', pattern=''):
     if type(command) == str:
-        return command.replace('${FILE}', mv_file).replace('${ITEM}', mv_item)
+        return command.replace('${FILE}', mv_file).replace('${ITEM}', mv_item).replace('${PATTERN}', pattern)
     else:
-        return list( map(lambda cmd: cmd.replace('${FILE}', mv_file).replace('${ITEM}', mv_item), command ) )
+        return list( map(lambda cmd: cmd.replace('${FILE}', mv_file).replace('${ITEM}', mv_item).replace('${PATTERN}', pattern), command ) )
+
+# Function: execute_batch
+# Run a list of commands on the MV server. If the batch_command setting is defined for the MV host the commands 
+# are written to a temporary paragraph in the MD/VOC and run with a single Execute (see <execute_paragraph>), 
+# otherwise each command is run with its own Execute.
+# 
+# Parameters:
+#   mv_svr - AccuTerm server object (see <connect>).
+#   commands - List of commands to run on server.
+# 
+# Returns:
+#   list - (command, output, status) for each command. The output is converted with <OUTPUT_TABLE>, the status
+#          is the last MV message number in the output (ex. 241 for "[241] Successful compile!"), None if 
+#          there is no message number and -1 if the command was not run.
+def execute_batch(mv_svr, commands):
+    if len(commands) > 1:
+        batch_command = get_setting_for_host(mv_svr, 'batch_command')
+        if type(batch_command) == list:
+            results = execute_paragraph(mv_svr, commands, batch_command)
+            if results != None: return results
+    results = []
+    for command in commands:
+        output = mv_translate(mv_svr.Execute(command, '', 1), OUTPUT_TABLE)
+        results.append( (command, output, get_message_number(output)) )
+    return results
+
+
+# Function: get_message_number
+# Returns the last MV message number (ex. [241]) in the output of a command, None if there is none.
+def get_message_number(output):
+    message_numbers = re.findall(r'^\[(\d+)\]', output, re.MULTILINE)
+    return int(message_numbers[-1]) if message_numbers else None
+
+
+# Paragraph slots in use by <execute_paragraph>, so batches run at the same time (ex. a compile and an 
+# Execute) write to different items in the MD/VOC.
+batch_slots = set()
+batch_slots_lock = threading.Lock()
+
+
+# Function: execute_paragraph
+# Run a list of commands with one Execute by writing them to a temporary paragraph in the MD/VOC. A marker is 
+# displayed before each command so the output can be split back into the output of each command. If the 
+# paragraph stops early the commands whose marker was not displayed are returned as not run.
+# 
+# Parameters:
+#   mv_svr - AccuTerm server object (see <connect>).
+#   commands - List of commands to run on server.
+#   batch_command - [paragraph header, command to display ${MARKER}] (see batch_command setting).
+# 
+# Returns:
+#   list - See <execute_batch>, None if the paragraph could not be written. If the paragraph ran but no markers 
+#          were displayed the whole output is returned as one section with an unknown (None) status, the 
+#          commands are not run again as they may already have run.
+def execute_paragraph(mv_svr, commands, batch_command):
+    (header, marker_command) = batch_command
+    marker = 'ACCUTERMCLIENT.' + str(int(time.time() * 1000)) + '.'
+    with batch_slots_lock:
+        slot = next( slot for slot in itertools.count() if slot not in batch_slots )
+        batch_slots.add(slot)
+    item_id = 'ACCUTERMCLIENT.BATCH.' + str(os.getpid()) + '.' + str(slot)
+    lines = [header]
+    for (index, command) in enumerate(commands):
+        lines.append(marker_command.replace('${MARKER}', marker + str(index)))
+        lines.append(command)
+    lines.append(marker_command.replace('${MARKER}', marker + 'END'))
+    try:
+        mv_svr.WriteItem(mv_svr.MDName, item_id, AM.join(lines), 0, 0, 0, 0)
+        if mv_svr.LastError: return None
+        output = mv_translate(mv_svr.Execute(item_id, '', 1), OUTPUT_TABLE)
+        try:
+            mv_svr.DeleteItem(mv_svr.MDName, item_id)
+        except Exception: # The paragraph is overwritten by the next batch in this slot.
+            pass
+    except Exception:
+        return None
+    finally:
+        with batch_slots_lock:
+            batch_slots.discard(slot)
+    markers = list(re.finditer('^' + re.escape(marker) + r'(\d+|END)[ \t]*$', output, re.MULTILINE))
+    if not markers: return [ ('\n'.join(commands), output.strip('\n'), None) ]
+    sections = {}
+    for (index, match) in enumerate(markers):
+        if match.group(1) == 'END': continue
+        end = markers[index + 1].start() if index + 1 < len(markers) else len(output)
+        sections[int(match.group(1))] = output[match.end():end].strip('\n')
+    return [ (command, sections[index], get_message_number(sections[index])) if index in sections else (command, '', -1)
+        for (index, command) in enumerate(commands) ]
+
 
 # Class: AccuTermUploadCommand
 # Upload the current view to the MV server.
 class AccuTermUploadCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return not is_data_item_view(self.view)
+
     def run(self, edit, mv_svr=None):
-        if not mv_svr: mv_svr = connect()
-        (mv_file, mv_item) = get_file_item(self.view)
-        data = self.view.substr( sublime.Region(0, self.view.size()) ).replace('\n', '\xFE')
-        if mv_svr.IsConnected():
-            if get_view_lock_state(self.view) == 'locked':
-                mv_svr.WriteItem(mv_file, mv_item, data, 0, 0, 0, 1)
-            else:
-                mv_svr.WriteItem(mv_file, mv_item, data, 0, 0, 0, 0)
-            check_error_message(self.view.window(), mv_svr, 'Uploaded to ' + mv_file + ' ' + mv_item)
+        upload(self.view, mv_svr)
 
 
 # Class: AccuTermCompileCommand
@@ -377,19 +1030,21 @@ class AccuTermCompileCommand(sublime_plugin.WindowCommand):
             result_line_regex = ''
         return result_line_regex
 
+    def is_enabled(self, **kwargs):
+        return self.window.active_view() != None and not is_data_item_view(self.window.active_view())
+
     def run(self, **kwargs):
         self.window.destroy_output_panel('exec')
         self.view = self.window.active_view()
         if self.view.is_dirty() and bool(self.view.file_name): self.view.run_command('save')
-        data = self.view.substr(sublime.Region(0, self.view.size())).replace('\n', '\xFE')        
+        data = encode_item(self.view.substr(sublime.Region(0, self.view.size())))
         sublime.set_timeout_async( lambda: self.upload(self, data = data), 0)
 
     def upload(self, *args, data=None):
-        if threading.currentThread ().getName() != 'MainThread':
-           pythoncom.CoInitialize ()
+        co_initialize()
 
         mv_svr = connect()
-        if upload(self.view, mv_svr): 
+        if upload(self.view, mv_svr, data): 
             log_output(self.window, mv_svr.LastErrorMessage, 'exec')
             return
 
@@ -414,10 +1069,13 @@ class AccuTermCompileCommand(sublime_plugin.WindowCommand):
                 compile_command = sublime.load_settings('AccuTermClient.sublime-settings').get('compile_command', 'BASIC')
                 if type(compile_command) == str:
                     result = mv_svr.Execute(expand_mv_command(compile_command, mv_file=mv_file, mv_item=mv_item))
+                    statuses = [ get_message_number(result) ]
                 else:
-                    result = '\n'.join( expand_mv_command(compile_command, mv_file=mv_file, mv_item=mv_item) )
+                    results = execute_batch(mv_svr, expand_mv_command(compile_command, mv_file=mv_file, mv_item=mv_item))
+                    result = '\n'.join( output if status != -1 else command + ': Not run.' for (command, output, status) in results )
+                    statuses = [ status for (command, output, status) in results ]
                 log_output(self.window, 'Compiling: ' + file_name + '\n' + result, 'exec')
-                if result.split('\n')[-1][:5] == '[241]': 
+                if 241 in statuses and -1 not in statuses: 
                     self.window.destroy_output_panel('exec')
                     self.window.status_message(mv_file + ' ' + mv_item + ' compiled')
         else:
@@ -467,10 +1125,36 @@ class AccuTermReplaceFileCommand(sublime_plugin.TextCommand):
         if self.view.is_loading():
             sublime.set_timeout_async(lambda: self.view.run_command('accu_term_replace_file', {"text": text}), 100)
         else:
-            text = text.replace(os.linesep, '\n')
             self.view.replace(edit, sublime.Region(0, self.view.size()), text)
 
 
+# Class: AccuTermInsertPendingCommand
+# Replace the contents of the current view with the text held in <pending_view_text> once the view has 
+# loaded. The text is inserted with a single replace so it is one undo step. Used internally by 
+# <replace_view_text> for large items.
+class AccuTermInsertPendingCommand(sublime_plugin.TextCommand):
+    # Function: run
+    # Parameters:
+    #   self - Sublime TextCommand instance.
+    #   edit - Sublime edit object.
+    #   serial - Identifies the pending text, a retry left over from a replaced download is ignored.
+    def run(self, edit, serial=None):
+        if self.view.id() not in pending_view_text: return
+        (text, caption, read_only, pending_serial) = pending_view_text[self.view.id()]
+        if serial != pending_serial: return
+        if self.view.is_loading():
+            sublime.set_timeout(lambda: self.view.run_command('accu_term_insert_pending', {"serial": serial}), 100)
+            return
+        del pending_view_text[self.view.id()]
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+        self.view.set_read_only(read_only or self.view.settings().get('AccuTermClient_verifying', False))
+        self.view.erase_status('AccuTermClient_progress')
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(0))
+        self.view.show(0)
+
+
 # Class: AccuTermDownload
 # Download an item from the MV server.
 class AccuTermDownload(sublime_plugin.WindowCommand):
@@ -587,12 +1271,12 @@ class AccuTermExecute(sublime_plugin.TextCommand):
             self.view = sublime.active_window().active_view()
         
         def append():
-            if threading.currentThread().getName() != 'MainThread': pythoncom.CoInitialize()
+            co_initialize()
             self.command_view.run_command('append', {'characters': self.run_commands(self.command)})
             self.command_view.run_command("accu_term_execute", {"output_to": "append"} )
 
         def log():
-            if threading.currentThread().getName() != 'MainThread': pythoncom.CoInitialize()
+            co_initialize()
             window = self.command_view.window() if bool(self.command_view.window()) else sublime.active_window()
             log_output(window, '\n')
             log_output(window, self.run_commands(self.command) )
@@ -626,12 +1310,12 @@ class AccuTermExecute(sublime_plugin.TextCommand):
         mv_svr = connect()
         if mv_svr.IsConnected():
             if type(commands) == str: commands = commands.split('\n')
-            for command in commands:
+            for (command, output, status) in execute_batch(mv_svr, commands):
                 results += command + '\n'
-                results += mv_svr.Execute(command, '', 1).replace('\x1b', '').replace(os.linesep, '\n') + '\n\n'
-                window = self.view.window()
-                if not window: window = sublime.active_window()
-                check_error_message(window, mv_svr, '')
+                results += (output if status != -1 else 'Not run, the commands stopped before reaching this command.') + '\n\n'
+            window = self.view.window()
+            if not window: window = sublime.active_window()
+            check_error_message(window, mv_svr, '')
         return results
 
 
@@ -730,7 +1414,12 @@ class AccuTermListCommand(sublime_plugin.WindowCommand):
             else:
                 self.list = ''.join(self.mv_svr.Execute('SORT ' + self.mv_file + ' A0 COL-HDR-SUPP ID-SUPP NOPAGE NI-SUPP', '', 1)).split('\r\n')
             self.list.insert(0, '..')
-            self.window.show_quick_panel(self.list, self.pickItem)
+            self.window.show_quick_panel(self.list, self.pickItem, 0, 0, self.highlightItem)
+
+    def highlightItem(self, item_index):
+        neighbours = sublime.load_settings('AccuTermClient.sublime-settings').get('prefetch_neighbours', 2)
+        indexes = sorted(range(max(1, item_index - neighbours), min(len(self.list), item_index + neighbours + 1)), key=lambda index: abs(index - item_index))
+        item_cache.prefetch([ (self.mv_file, self.list[index]) for index in indexes if self.list[index] ])
 
     def pickItem(self, item_index):
         if item_index == 0:
@@ -817,9 +1506,27 @@ class AccuTermCheckSyncCommand(sublime_plugin.TextCommand):
 # Class: EventListener        
 # Register event handlers.
 class EventListener(sublime_plugin.EventListener):
+    def on_activated(self, view):
+        global last_activity_time
+        last_activity_time = time.time()
+        write_back_queue.show_status(view)
+
+    def on_modified(self, view):
+        global last_activity_time
+        last_activity_time = time.time()
+
     def on_pre_close(self, view):
+        pending_view_text.pop(view.id(), None)
+        data_item_views.pop(view.id(), None)
+        diff_views.pop(view.id(), None)
         lock_state = view.settings().get('AccuTermClient_lock_state', None)
         if lock_state == 'locked': view.run_command('accu_term_release')
+        if is_mv_syntax(view) and view.settings().get('AccuTermClient_mv_file_item'): 
+            item_cache.prefetch([ tuple(view.settings().get('AccuTermClient_mv_file_item')) ])
+
+    def on_text_command(self, view, command_name, args):
+        if command_name == 'drag_select' and args.get('by') == 'words' and view.settings().get('AccuTermClient_search_results'):
+            sublime.set_timeout(lambda: view.run_command('accu_term_search_open'), 0)
 
     def on_window_command(self, window, command_name, args):
         if command_name in ['prev_result', 'next_result']:
@@ -855,6 +1562,13 @@ class AccuTermClientLoadListener(sublime_plugin.ViewEventListener):
     def on_load(self):
         self.check = True
 
+    def on_activated_async(self):
+        (mv_file, mv_item) = get_file_item(self.view)
+        if mv_file and not symbol_index.has_item(mv_file, mv_item): index_view(self.view)
+
+    def on_post_save_async(self):
+        index_view(self.view)
+
     def on_activated(self):
         if not getattr(self, 'check', False): return 
         self.check = False
@@ -864,20 +1578,77 @@ class AccuTermClientLoadListener(sublime_plugin.ViewEventListener):
 
 
 
+# Time of the last edit or view activation, used to wait for Sublime to be idle before startup work.
+last_activity_time = 0
+
+
+# Function: get_views_by_visibility
+# Returns the MV views in all windows, visible views (the active view of each group) first.
+def get_views_by_visibility():
+    visible = []
+    hidden = []
+    for window in sublime.windows():
+        active_views = [ window.active_view_in_group(group) for group in range(window.num_groups()) ]
+        for view in window.views():
+            if not is_mv_syntax(view): continue
+            if view in active_views:
+                visible.append(view)
+            else:
+                hidden.append(view)
+    return visible + hidden
+
+
+# Function: when_idle
+# Run a function on the async thread once there has been no editing for the startup_idle_delay setting (ms).
+def when_idle(function):
+    idle_delay = sublime.load_settings('AccuTermClient.sublime-settings').get('startup_idle_delay', 1000)
+    wait = idle_delay - int((time.time() - last_activity_time) * 1000)
+    if wait > 0:
+        sublime.set_timeout(lambda: when_idle(function), wait)
+    else:
+        sublime.set_timeout_async(function, 0)
+
+
+# Function: reconcile_views
+# Check sync and restore locks for MV views, in order of visibility. Views are handled until the 
+# startup_time_budget setting (ms) is used, the remaining views are handled the next time Sublime is idle.
+# 
+# Parameters:
+#   views - List of Sublime view objects (see <get_views_by_visibility>).
+#   start_time - Time the startup began, used to log the startup timing.
+def reconcile_views(views, start_time):
+    slice_time = time.time()
+    budget = sublime.load_settings('AccuTermClient.sublime-settings').get('startup_time_budget', 200)
+    co_initialize()
+    mv_svr = connect(log_errors=False)
+    if not mv_svr.IsConnected(): 
+        print('AccuTermClient: AccuTerm not reachable, ' + str(len(views)) + ' views not checked')
+        return
+    while views and (time.time() - slice_time) * 1000 < budget:
+        view = views.pop(0)
+        if not view.is_valid(): continue
+        check_sync(view, mv_svr=mv_svr)
+        if get_view_lock_state(view) in ['locked', 'released']:
+            view.run_command('accu_term_lock')
+    mv_svr.Disconnect()
+    if views:
+        when_idle(lambda: reconcile_views(views, start_time))
+    else:
+        print('AccuTermClient: views checked in ' + str(int((time.time() - start_time) * 1000)) + ' ms')
+
+
 # Event: plugin_loaded
-# Lock all MV items that were locked previously and check sync with MV server. Triggered by Sublime during startup.
+# Startup is staged so Sublime is not held up by AccuTerm. COM is imported on first use, then once Sublime 
+# is idle the MV views are checked with <reconcile_views>, the symbol index is updated with any local MV 
+# items that have changed and uploads queued while offline are retried. Triggered by Sublime during startup.
 def plugin_loaded():
-    def run():
-        if threading.currentThread().getName() != 'MainThread': pythoncom.CoInitialize()
-        mv_svr = connect()
-        if not mv_svr.IsConnected(): return 
-        for window in sublime.windows():
-            for view in window.views():
-                if not is_mv_syntax(view): continue
-                check_sync(view, mv_svr=mv_svr)
-                if get_view_lock_state(view) in ['locked', 'released']:
-                    view.run_command('accu_term_lock')
-    sublime.set_timeout_async( lambda: run(), 0)
+    global last_activity_time
+    start_time = time.time()
+    last_activity_time = start_time
+    when_idle(lambda: reconcile_views(get_views_by_visibility(), start_time))
+    when_idle(lambda: index_mirror(sublime.active_window()))
+    when_idle(write_back_queue.load)
+    print('AccuTermClient: plugin loaded in ' + str(int((time.time() - start_time) * 1000)) + ' ms')
 
 
 # Class: AccuTermRunCommand
@@ -892,3 +1663,873 @@ class AccuTermRunCommand(sublime_plugin.TextCommand):
             else: 
                 command = 'RUN ' + mv_file + ' ' + mv_item
             self.view.run_command('accu_term_execute', {"output_to": 'console', "command": command})
+
+
+# Class: DataItem
+# State of a data item view. The item is held in a <DynamicArray> and only the fields that have been 
+# expanded are rendered in the view.
+# 
+# The shown dictionary maps an expanded field to the [first, last] child fields rendered, () holds the 
+# range of attributes rendered. Rows for the hidden fields before and after the range are stored as 
+# field numbers 0 and -1.
+class DataItem:
+    def __init__(self, mv_file, mv_item, data):
+        self.mv_file = mv_file
+        self.mv_item = mv_item
+        self.record = DynamicArray(decode_item(data), '\n')
+        self.rows = []
+        settings = sublime.load_settings('AccuTermClient.sublime-settings')
+        self.page_size = settings.get('data_item_page_size', 500)
+        self.preview_width = settings.get('data_item_preview_width', 120)
+        self.shown = {(): [1, self.page_size]}
+
+    # Function: is_leaf
+    # Returns True if a field does not contain values or subvalues.
+    def is_leaf(self, field):
+        if len(field) == 3 or self.record.count(*field) > 1: return len(field) == 3
+        return len(field) == 2 or self.record.count(field[0], 1) == 1
+
+    # Function: expand
+    # Expand the fields above a field so it will be rendered, centering the range on the field if needed.
+    def expand(self, field):
+        for depth in range(len(field)):
+            (key, n) = (field[:depth], field[depth])
+            (first, last) = self.shown.get(key, [1, 0])
+            if n < first or n > last:
+                first = max(1, n - self.page_size // 2)
+                self.shown[key] = [first, first + self.page_size - 1]
+
+    # Function: toggle
+    # Expand or collapse a field, or render the next page of fields for a "more" row.
+    def toggle(self, field):
+        key = field[:-1]
+        if field[-1] == 0:
+            self.shown[key][0] = max(1, self.shown[key][0] - self.page_size)
+        elif field[-1] == -1:
+            self.shown[key][1] += self.page_size
+        elif field in self.shown:
+            for key in [key for key in self.shown if key[:len(field)] == field]: del self.shown[key]
+        elif not self.is_leaf(field):
+            self.shown[field] = [1, self.page_size]
+
+    # Function: render
+    # Returns the text of the view, one line per rendered field. The field shown on each line is stored in rows.
+    def render(self):
+        lines = []
+        self.rows = []
+        self.render_level((), lines)
+        return '\n'.join(lines)
+
+    def render_level(self, key, lines):
+        indent = '  ' * len(key)
+        total = self.record.count(*key)
+        (first, last) = (self.shown[key][0], min(total, self.shown[key][1]))
+        if first > 1:
+            lines.append(indent + '  ... ' + str(first - 1) + ' earlier')
+            self.rows.append(key + (0,))
+        for n in range(first, last + 1):
+            field = key + (n,)
+            (start, end) = self.record.bounds(*field)
+            preview = mv_translate(self.record.text[start:min(end, start + self.preview_width)], DISPLAY_TABLE)
+            if end - start > self.preview_width: preview += '...'
+            if self.is_leaf(field):
+                line = indent + '  ' + '.'.join(map(str, field)) + '  ' + preview
+            else:
+                marker = '- ' if field in self.shown else '+ '
+                children = self.record.count(*field)
+                line = indent + marker + '.'.join(map(str, field)) + '  ' + preview + '  (' + str(children) + (' values)' if len(key) == 0 else ' subvalues)')
+            lines.append(line)
+            self.rows.append(field)
+            if field in self.shown: self.render_level(field, lines)
+        if last < total:
+            lines.append(indent + '  ... ' + str(total - last) + ' more')
+            self.rows.append(key + (-1,))
+
+    # Function: field_at
+    # Returns the field rendered on the line containing point.
+    def field_at(self, view, point):
+        row = view.rowcol(point)[0]
+        return self.rows[row] if row < len(self.rows) else None
+
+
+# State of open data item views, keyed by view id (see <DataItem>).
+data_item_views = {}
+
+
+# Function: get_data_item
+# Returns the <DataItem> for a view, None if the view is not a data item view.
+def get_data_item(view):
+    return data_item_views.get(view.id(), None)
+
+
+# Function: is_data_item_view
+# Returns True if a view is a data item view. The view shows a rendering of the item, not its contents, so 
+# it must never be uploaded.
+def is_data_item_view(view):
+    return view.settings().get('AccuTermClient_data_item', False)
+
+
+# Function: parse_field
+# Parses an "a,v,s" (or "<a,v,s>" or "a.v.s") field reference into a tuple of ints.
+def parse_field(field_ref):
+    field = tuple( int(n) for n in re.split(r'[,.\s]+', field_ref.strip().strip('<>').strip()) if n != '' )
+    if len(field) < 1 or len(field) > 3 or min(field) < 1: raise ValueError(field_ref)
+    return field
+
+
+# Class: AccuTermDataItemCommand
+# Open an item from the MV server in a data item view. Attributes are listed one per line and multivalued
+# attributes can be expanded to show their values and subvalues.
+class AccuTermDataItemCommand(sublime_plugin.WindowCommand):
+    def on_done(self, item_ref):
+        item_ref = item_ref.split()
+        if len(item_ref) != 2:
+            log_output(self.window, 'Invalid Input: ' + ' '.join(item_ref) + ' (Must be [file] [item])')
+            return
+        [mv_file, mv_item] = item_ref
+        mv_svr = connect()
+        if mv_svr:
+            if bool( mv_svr.ItemExists(mv_file, mv_item) ):
+                (data, readu_flag) = read_item(mv_svr, mv_file, mv_item)
+                if check_error_message(self.window, mv_svr, 'Download success'):
+                    view = self.window.new_file()
+                    view.set_name(mv_file + ' ' + mv_item)
+                    view.set_scratch(True)
+                    view.settings().set('AccuTermClient_data_item', True)
+                    view.settings().set('AccuTermClient_mv_file_item', [mv_file, mv_item])
+                    view.settings().set('AccuTermClient_lock_state', 'locked' if readu_flag else 'no_locking')
+                    view.settings().set('word_wrap', False)
+                    view.set_status('AccuTermClient_lock_state', view.settings().get('AccuTermClient_lock_state', ''))
+                    data_item_views[view.id()] = DataItem(mv_file, mv_item, data)
+                    view.run_command('accu_term_data_item_render')
+            else:
+                log_output(self.window, mv_file + ' ' + mv_item + ' not found.')
+            mv_svr.Disconnect()
+
+    def run(self, **kwargs):
+        self.window.show_input_panel('Enter the MV file and item', '', self.on_done, None, None)
+
+
+# Class: AccuTermDataItemRenderCommand
+# Redraw a data item view and move the cursor to a field. Used internally by the data item commands.
+class AccuTermDataItemRenderCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return get_data_item(self.view) != None
+
+    # Function: run
+    # Parameters:
+    #   self - Sublime TextCommand instance.
+    #   edit - Sublime edit object.
+    #   field - List of [a, v, s] to move the cursor to (defaults to the field under the cursor).
+    def run(self, edit, field=None):
+        data_item = get_data_item(self.view)
+        if field == None and len(self.view.sel()) > 0: field = data_item.field_at(self.view, self.view.sel()[0].begin())
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), data_item.render())
+        self.view.set_read_only(True)
+        row = data_item.rows.index(tuple(field)) if field and tuple(field) in data_item.rows else 0
+        point = self.view.text_point(row, 0)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(point))
+        self.view.show(point)
+
+
+# Class: AccuTermDataItemToggleCommand
+# Expand or collapse the field under the cursor in a data item view.
+class AccuTermDataItemToggleCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return get_data_item(self.view) != None
+
+    def run(self, edit):
+        data_item = get_data_item(self.view)
+        field = data_item.field_at(self.view, self.view.sel()[0].begin())
+        if field == None: return
+        data_item.toggle(field)
+        self.view.run_command('accu_term_data_item_render', {"field": field[:-1] if field[-1] < 1 else field})
+
+
+# Class: AccuTermDataItemGotoCommand
+# Move the cursor to a field in a data item view by entering <a,v,s>.
+class AccuTermDataItemGotoCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return get_data_item(self.view) != None
+
+    def on_done(self, field_ref):
+        data_item = get_data_item(self.view)
+        try:
+            field = parse_field(field_ref)
+        except ValueError:
+            self.view.window().status_message('Invalid field: ' + field_ref + ' (Must be a,v,s)')
+            return
+        if data_item.record.bounds(*field) == None:
+            self.view.run_command('accu_term_data_item_edit', {"field": field})
+            return
+        while len(field) > 1 and data_item.is_leaf(field[:-1]): field = field[:-1]
+        data_item.expand(field)
+        self.view.run_command('accu_term_data_item_render', {"field": field})
+
+    def run(self, edit):
+        self.view.window().show_input_panel('Enter the field (a,v,s)', '', self.on_done, None, None)
+
+
+# Class: AccuTermDataItemEditCommand
+# Edit the field under the cursor in a data item view. Only the field is written to the MV server, so other 
+# changes made to the item on the server are kept. The view is updated once the write has succeeded.
+class AccuTermDataItemEditCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return get_data_item(self.view) != None
+
+    def on_done(self, field, value):
+        data_item = get_data_item(self.view)
+        if data_item == None: return
+        mv_svr = connect()
+        if mv_svr.IsConnected():
+            (a, v, sv) = (tuple(field) + (0, 0))[:3]
+            lock_flag = 1 if get_view_lock_state(self.view) == 'locked' else 0
+            mv_svr.WriteItem(data_item.mv_file, data_item.mv_item, value, a, v, sv, lock_flag)
+            item_cache.discard(data_item.mv_file, data_item.mv_item)
+            if check_error_message(self.view.window(), mv_svr, 'Updated ' + data_item.mv_file + ' ' + data_item.mv_item + ' <' + ','.join(map(str, field)) + '>'):
+                data_item.record.replace(a, v, sv, value=value)
+                data_item.expand(tuple(field))
+                self.view.run_command('accu_term_data_item_render', {"field": field})
+
+    # Function: run
+    # Parameters:
+    #   self - Sublime TextCommand instance.
+    #   edit - Sublime edit object.
+    #   field - List of [a, v, s] to edit (defaults to the field under the cursor).
+    def run(self, edit, field=None):
+        data_item = get_data_item(self.view)
+        if field == None: field = data_item.field_at(self.view, self.view.sel()[0].begin())
+        if field == None or field[-1] < 1: return
+        field = tuple(field)
+        if data_item.record.bounds(*field) != None and not data_item.is_leaf(field):
+            self.view.window().status_message('Expand <' + ','.join(map(str, field)) + '> to edit its values')
+            return
+        self.view.window().show_input_panel('<' + ','.join(map(str, field)) + '>', data_item.record.extract(*field), 
+            lambda value: self.on_done(field, value), None, None)
+
+
+# Function: open_item_at_line
+# Open an MV item (with <download> if it is not already open) and move the cursor to a line.
+# 
+# Parameters:
+#   window - Sublime window object.
+#   mv_file - Filename on MV server.
+#   mv_item - Item ID on MV server.
+#   line - Line number, starting at 1.
+# 
+# Returns:
+#   view - Sublime view object, None if the item could not be opened.
+def open_item_at_line(window, mv_file, mv_item, line=1):
+    file_name = get_filename(window, mv_file, mv_item)
+    view = find_view(file_name)
+    if view == None:
+        download(window, mv_file, mv_item)
+        view = find_view(file_name)
+    if view == None: return None
+    window.focus_view(view)
+    point = view.text_point(max(line, 1) - 1, 0)
+    view.sel().clear()
+    view.sel().add(sublime.Region(point))
+    view.show_at_center(point)
+    return view
+
+
+# Function: search_lines
+# Returns the (line number, line) of each line in text that contains pattern.
+def search_lines(lines, pattern):
+    return [ (line_no, line.rstrip('\r\n')) for (line_no, line) in enumerate(lines, 1) if pattern in line ]
+
+
+# Function: search_file
+# Search a local file line by line without reading the whole file into memory.
+def search_file(file_name, pattern):
+    with open(file_name, encoding='utf-8', errors='replace') as file:
+        return search_lines(file, pattern)
+
+
+# Function: escape_search_pattern
+# Escape the search text for the search_command of the MV host with the search_pattern_escape setting, a 
+# list of [character, replacement] pairs. A null replacement means the character can not be escaped.
+# 
+# Parameters:
+#   mv_svr - AccuTerm server object (see <connect>).
+#   pattern - Text to search for.
+# 
+# Returns:
+#   string - Escaped search text, None if it contains a character that can not be escaped.
+def escape_search_pattern(mv_svr, pattern):
+    escapes = get_setting_for_host(mv_svr, 'search_pattern_escape')
+    if type(escapes) != list: return pattern
+    for (character, replacement) in escapes:
+        if character not in pattern: continue
+        if replacement == None: return None
+        pattern = pattern.replace(character, replacement)
+    return pattern
+
+
+# Class: AccuTermSearchCommand
+# Search the items in an MV file and stream the matching lines into a find results view.
+# 
+# Modes:
+#   mirror - Search the local copy of the file (in the folder used by <download>) using a pool of threads.
+#   host - Run the search_command setting on the MV server. The output may either be a list of item IDs, 
+#          which are then read to find the matching lines, or grep style "file/item:line:text" lines.
+class AccuTermSearchCommand(sublime_plugin.WindowCommand):
+    grep_line_regex = re.compile(r'^(?:.*[/\\])?([^/\\:]+):(\d+):(.*)$')
+
+    def run(self, mode='mirror'):
+        self.mode = mode
+        self.window.show_input_panel('Enter the MV file and search text', '', self.on_done, None, None)
+
+    def on_done(self, search_ref):
+        search_ref = search_ref.strip().split(None, 1)
+        if len(search_ref) != 2:
+            log_output(self.window, 'Invalid Input: ' + ' '.join(search_ref) + ' (Must be [file] [search text])')
+            return
+        (mv_file, pattern) = search_ref
+        self.results_view = self.window.new_file()
+        self.results_view.set_name('Search ' + mv_file + ': ' + pattern)
+        self.results_view.set_scratch(True)
+        self.results_view.set_syntax_file('Packages/Default/Find Results.hidden-tmLanguage')
+        self.results_view.settings().set('AccuTermClient_search_results', True)
+        self.results_view.settings().set('word_wrap', False)
+        self.match_count = 0
+        self.item_count = 0
+        self.append('Searching ' + mv_file + ' for "' + pattern + '" (' + self.mode + ')\n\n')
+        if self.mode == 'host':
+            sublime.set_timeout_async(lambda: self.search_host(mv_file, pattern), 0)
+        else:
+            sublime.set_timeout_async(lambda: self.search_mirror(mv_file, pattern), 0)
+
+    def append(self, text):
+        self.results_view.run_command('append', {'characters': text, 'force': True, 'scroll_to_end': False})
+
+    # Function: add_results
+    # Append the matching lines of an item to the results view.
+    def add_results(self, mv_file, mv_item, matches):
+        if not matches: return
+        self.item_count += 1
+        self.match_count += len(matches)
+        self.append(mv_file + ' ' + mv_item + ':\n' + ''.join('  ' + str(line_no) + ': ' + line + '\n' for (line_no, line) in matches) + '\n')
+
+    def finish(self):
+        self.append(str(self.match_count) + ' matches in ' + str(self.item_count) + ' items\n')
+
+    def search_mirror(self, mv_file, pattern):
+        mirror_dir = os.path.join(get_base_path(self.window), mv_file)
+        if not os.path.isdir(mirror_dir):
+            log_output(self.window, 'No local copy of ' + mv_file + ' found in ' + mirror_dir)
+            return
+        file_names = [ file_name for file_name in os.listdir(mirror_dir) if os.path.isfile(os.path.join(mirror_dir, file_name)) ]
+        workers = sublime.load_settings('AccuTermClient.sublime-settings').get('search_workers', 4)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            searches = dict( (executor.submit(search_file, os.path.join(mirror_dir, file_name), pattern), file_name) for file_name in file_names )
+            for search in concurrent.futures.as_completed(searches):
+                try:
+                    self.add_results(mv_file, get_item_name(searches[search]), search.result())
+                except (IOError, OSError) as error:
+                    log_output(self.window, str(error))
+        self.finish()
+
+    def search_host(self, mv_file, pattern):
+        co_initialize()
+        mv_svr = connect()
+        if not mv_svr.IsConnected(): return
+        search_command = get_setting_for_host(mv_svr, 'search_command')
+        if not search_command:
+            log_output(self.window, 'The search_command setting is not defined for this MV server.')
+            return
+        escaped_pattern = escape_search_pattern(mv_svr, pattern)
+        if escaped_pattern == None:
+            log_output(self.window, 'The search text ' + pattern + ' contains a character that can not be passed to the MV server.')
+            mv_svr.Disconnect()
+            return
+        output = mv_translate(mv_svr.Execute(expand_mv_command(search_command, mv_file=mv_file, pattern=escaped_pattern), '', 1), OUTPUT_TABLE)
+        if not check_error_message(self.window, mv_svr, ''): return
+        grep_matches = {}
+        for line in output.split('\n'):
+            match = self.grep_line_regex.match(line)
+            if match:
+                grep_matches.setdefault(match.group(1), []).append( (int(match.group(2)), match.group(3)) )
+            elif line.strip():
+                mv_item = line.strip()
+                data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
+                if mv_svr.LastError == 0: self.add_results(mv_file, mv_item, search_lines(decode_item(data).split('\n'), pattern))
+        for mv_item in grep_matches:
+            self.add_results(mv_file, mv_item, grep_matches[mv_item])
+        mv_svr.Disconnect()
+        self.finish()
+
+
+# Class: AccuTermSearchOpenCommand
+# Open the item and line under the cursor in a search results view.
+class AccuTermSearchOpenCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return bool(self.view.settings().get('AccuTermClient_search_results'))
+
+    def run(self, edit):
+        row = self.view.rowcol(self.view.sel()[0].begin())[0]
+        match = re.match(r'^\s+(\d+):', self.view.substr(self.view.line(self.view.text_point(row, 0))))
+        line = int(match.group(1)) if match else 1
+        while row >= 0:
+            header = re.match(r'^(\S+) (\S+):$', self.view.substr(self.view.line(self.view.text_point(row, 0))))
+            if header: break
+            if not match: return
+            row -= 1
+        if header: open_item_at_line(self.view.window(), header.group(1), header.group(2), line)
+
+
+# Class: SymbolIndex
+# Index of the symbols defined and referenced in MV BASIC items. Each item is parsed with <parse_symbols> 
+# and stored with a stamp (the modified time of the local file) so unchanged items are not parsed again. 
+# The index is saved to the Sublime cache folder and loaded on first use.
+# 
+# Definitions:
+#   label - Statement label, only visible in the item that defines it.
+#   equate - EQUATE name, visible in the item that defines it and the items that include it.
+#   subroutine, function, program - Declaration at the start of the item.
+# 
+# References:
+#   gosub - GOSUB or GOTO label.
+#   call - CALL target.
+#   include - INCLUDE, $INCLUDE, $INSERT or $CHAIN item.
+class SymbolIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.items = None
+        self.save_pending = False
+
+    def get_path(self):
+        return os.path.join(sublime.cache_path(), 'AccuTermClient', 'symbols.json')
+
+    # Function: load
+    # Load the saved index and build the lookup tables. Called on first use.
+    def load(self):
+        with self.lock:
+            if self.items != None: return
+            self.items = {}
+            self.definitions_by_name = {}
+            self.references_by_name = {}
+            try:
+                with open(self.get_path(), encoding='utf-8') as file:
+                    items = json.load(file)
+            except (IOError, OSError, ValueError):
+                items = {}
+            for key in items:
+                self.add(key, items[key])
+
+    # Function: save
+    # Save the index to the Sublime cache folder. Saves are batched, so many updates result in one write.
+    def save(self):
+        with self.lock:
+            if self.save_pending: return
+            self.save_pending = True
+        def write():
+            with self.lock:
+                self.save_pending = False
+                text = json.dumps(self.items)
+            if not os.path.exists(os.path.dirname(self.get_path())): os.makedirs(os.path.dirname(self.get_path()))
+            with open(self.get_path(), 'w', encoding='utf-8') as file:
+                file.write(text)
+        sublime.set_timeout_async(write, 5000)
+
+    def add(self, key, entry):
+        self.items[key] = entry
+        for (name, kind, line) in entry['defs']: self.definitions_by_name.setdefault(name, set()).add(key)
+        for (name, kind, line, mv_file) in entry['refs']: self.references_by_name.setdefault(name, set()).add(key)
+
+    def remove(self, key):
+        entry = self.items.pop(key, None)
+        if entry == None: return
+        for (name, kind, line) in entry['defs']: self.definitions_by_name.get(name, set()).discard(key)
+        for (name, kind, line, mv_file) in entry['refs']: self.references_by_name.get(name, set()).discard(key)
+
+    def has_item(self, mv_file, mv_item):
+        self.load()
+        return mv_file + '\t' + mv_item in self.items
+
+    # Function: update
+    # Parse an item and replace its symbols in the index, unless the stamp shows it has not changed.
+    # 
+    # Parameters:
+    #   mv_file - Filename on MV server.
+    #   mv_item - Item ID on MV server.
+    #   text - Contents of the item, or a function returning the contents (only called if the item has changed).
+    #   stamp - Modified time of the local file, None to always parse the item.
+    def update(self, mv_file, mv_item, text, stamp=None):
+        self.load()
+        key = mv_file + '\t' + mv_item
+        with self.lock:
+            if stamp != None and key in self.items and self.items[key]['stamp'] == stamp: return
+        if callable(text): text = text()
+        (definitions, references) = parse_symbols(text)
+        with self.lock:
+            self.remove(key)
+            self.add(key, {'stamp': stamp, 'defs': definitions, 'refs': references})
+        self.save()
+
+    # Function: definitions
+    # Returns a list of (mv_file, mv_item, line, kind) for the definitions of name.
+    def definitions(self, name):
+        self.load()
+        with self.lock:
+            return [ tuple(key.split('\t')) + (line, kind) for key in self.definitions_by_name.get(name, ())
+                for (def_name, kind, line) in self.items[key]['defs'] if def_name == name ]
+
+    # Function: references
+    # Returns a list of (mv_file, mv_item, line, kind) for the references to name.
+    def references(self, name):
+        self.load()
+        with self.lock:
+            return [ tuple(key.split('\t')) + (line, kind) for key in self.references_by_name.get(name, ())
+                for (ref_name, kind, line, mv_file) in self.items[key]['refs'] if ref_name == name ]
+
+    # Function: targets
+    # Returns a list of (mv_file, mv_item) referenced by an item. CALL targets are assumed to be in the same file.
+    # 
+    # Parameters:
+    #   mv_file - Filename on MV server.
+    #   mv_item - Item ID on MV server.
+    #   kinds - Kinds of reference to include (defaults to include).
+    def targets(self, mv_file, mv_item, kinds=('include',)):
+        self.load()
+        with self.lock:
+            entry = self.items.get(mv_file + '\t' + mv_item, {'refs': []})
+            return [ (target_file if target_file else mv_file, name) for (name, kind, line, target_file) in entry['refs'] if kind in kinds ]
+
+
+symbol_index = SymbolIndex()
+
+
+# Regular expressions used by <parse_symbols>.
+symbol_name = r'[A-Za-z0-9_.$%]+'
+symbol_strings_regex = re.compile(r'"[^"]*"|\'[^\']*\'')
+symbol_comment_regex = re.compile(r';\s*(?:\*|!|REM\b).*$', re.IGNORECASE)
+symbol_label_regex = re.compile(r'^\s*(?:(\d+)(?=\s|$|;)|([A-Za-z][A-Za-z0-9_.$%]*):(?=\s|$|;))')
+symbol_declaration_regex = re.compile(r'^\s*(SUBROUTINE|FUNCTION|PROGRAM)\s+(' + symbol_name + ')', re.IGNORECASE)
+symbol_call_regex = re.compile(r'\bCALL\s+(' + symbol_name + ')', re.IGNORECASE)
+symbol_gosub_regex = re.compile(r'\b(?:GOSUB|GO\s*TO)\s+(' + symbol_name + r'(?:\s*,\s*' + symbol_name + ')*)', re.IGNORECASE)
+symbol_include_regex = re.compile(r'^\s*(?:\$?INCLUDE|\$INSERT|\$CHAIN)\s+([^\s,]+)(?:[\s,]+([^\s,;]+))?', re.IGNORECASE)
+symbol_equate_regex = re.compile(r'^\s*EQU(?:ATE)?\s', re.IGNORECASE)
+symbol_equate_name_regex = re.compile(r'(?:^|,)\s*(' + symbol_name + r')\s+(?:TO|LIT)\b', re.IGNORECASE)
+
+
+# Function: parse_symbols
+# Find the symbols defined and referenced in MV BASIC source code (see <SymbolIndex>).
+# 
+# Parameters:
+#   text - MV BASIC source code.
+# 
+# Returns:
+#   tuple - [0] List of [name, kind, line] definitions.
+# 
+#           [1] List of [name, kind, line, mv_file] references, mv_file is only set for includes from another file.
+def parse_symbols(text):
+    definitions = []
+    references = []
+    for (line_no, line) in enumerate(text.split('\n'), 1):
+        stripped = line.strip()
+        if not stripped or stripped[0] in '*!' or stripped[:4].upper() == 'REM ': continue
+        line = symbol_comment_regex.sub('', symbol_strings_regex.sub('""', line))
+        match = symbol_label_regex.match(line)
+        if match: definitions.append([match.group(1) or match.group(2), 'label', line_no])
+        match = symbol_declaration_regex.match(line)
+        if match: definitions.append([match.group(2), match.group(1).lower(), line_no])
+        match = symbol_include_regex.match(line)
+        if match:
+            (mv_file, name) = (match.group(1), match.group(2)) if match.group(2) else ('', match.group(1))
+            references.append([name, 'include', line_no, mv_file])
+            continue
+        if symbol_equate_regex.match(line):
+            for match in symbol_equate_name_regex.finditer(symbol_equate_regex.sub('', line)):
+                definitions.append([match.group(1), 'equate', line_no])
+            continue
+        for match in symbol_call_regex.finditer(line):
+            references.append([match.group(1), 'call', line_no, ''])
+        for match in symbol_gosub_regex.finditer(line):
+            for name in match.group(1).split(','):
+                references.append([name.strip(), 'gosub', line_no, ''])
+    return (definitions, references)
+
+
+# Function: index_view
+# Update the <SymbolIndex> with the contents of a view.
+def index_view(view):
+    (mv_file, mv_item) = get_file_item(view)
+    if not mv_file or not mv_item: return
+    stamp = None
+    if view.file_name() and not view.is_dirty() and os.path.exists(view.file_name()): stamp = os.path.getmtime(view.file_name())
+    symbol_index.update(mv_file, mv_item, view.substr(sublime.Region(0, view.size())), stamp)
+
+
+# Function: index_mirror
+# Update the <SymbolIndex> with the local copies of MV items (the folders used by <download>). Only items
+# that have changed since they were last indexed are parsed.
+def index_mirror(window):
+    base_path = get_base_path(window)
+    remove_file_ext = sublime.load_settings('AccuTermClient.sublime-settings').get('remove_file_extensions')
+    if not os.path.isdir(base_path): return
+    for mv_file in os.listdir(base_path):
+        mirror_dir = os.path.join(base_path, mv_file)
+        if not os.path.isdir(mirror_dir): continue
+        for file_name in os.listdir(mirror_dir):
+            if os.path.splitext(file_name.lower())[1][1:] not in remove_file_ext: continue
+            path = os.path.join(mirror_dir, file_name)
+            def read(path=path):
+                with open(path, encoding='utf-8', errors='replace') as file:
+                    return file.read().replace('\r\n', '\n')
+            try:
+                symbol_index.update(mv_file, get_item_name(file_name), read, os.path.getmtime(path))
+            except (IOError, OSError):
+                pass
+
+
+# Function: get_symbol_at
+# Returns the MV BASIC name at a point in a view. Unlike view.word names may contain periods.
+def get_symbol_at(view, point):
+    line = view.line(point)
+    text = view.substr(line)
+    for match in re.finditer(symbol_name, text):
+        if match.start() <= point - line.begin() <= match.end(): return (match.group(), text)
+    return (None, text)
+
+
+# Function: show_symbol_locations
+# Open a symbol location, or let the user pick one if there is more than one.
+# 
+# Parameters:
+#   window - Sublime window object.
+#   locations - List of (mv_file, mv_item, line, kind).
+def show_symbol_locations(window, locations):
+    locations = sorted(set(locations))
+    if len(locations) == 1:
+        open_item_at_line(window, *locations[0][:3])
+    elif locations:
+        window.show_quick_panel([ [mv_file + ' ' + mv_item + ':' + str(line), kind] for (mv_file, mv_item, line, kind) in locations ],
+            lambda index: open_item_at_line(window, *locations[index][:3]) if index > -1 else None)
+
+
+# Class: AccuTermGotoDefinitionCommand
+# Go to the definition of the label, subroutine, function, equate or include under the cursor. Items that
+# are not in the <SymbolIndex> are downloaded from the MV server.
+class AccuTermGotoDefinitionCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        window = self.view.window()
+        (name, line) = get_symbol_at(self.view, self.view.sel()[0].begin())
+        if not name: return
+        (mv_file, mv_item) = get_file_item(self.view)
+        include = symbol_include_regex.match(line)
+        if include:
+            (include_file, include_item) = (include.group(1), include.group(2)) if include.group(2) else (mv_file, include.group(1))
+            open_item_at_line(window, include_file, include_item)
+            return
+        if not symbol_index.has_item(mv_file, mv_item): index_view(self.view)
+        definitions = symbol_index.definitions(name)
+        local_items = [(mv_file, mv_item)] + symbol_index.targets(mv_file, mv_item)
+        locations = [ location for location in definitions if location[:2] in local_items ]
+        if not locations: 
+            locations = [ location for location in definitions if location[3] in ['subroutine', 'function', 'program'] ]
+        if locations:
+            show_symbol_locations(window, locations)
+        elif symbol_call_regex.search(line) and name in [ match.group(1) for match in symbol_call_regex.finditer(line) ]:
+            view = open_item_at_line(window, mv_file, name)
+            if view: index_view(view)
+        else:
+            window.status_message('No definition found for ' + name)
+
+
+# Class: AccuTermFindReferencesCommand
+# List the CALL, GOSUB/GOTO and INCLUDE references to the name under the cursor.
+class AccuTermFindReferencesCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        window = self.view.window()
+        (name, line) = get_symbol_at(self.view, self.view.sel()[0].begin())
+        if not name: return
+        (mv_file, mv_item) = get_file_item(self.view)
+        index_view(self.view)
+        locations = [ location for location in symbol_index.references(name) 
+            if location[3] != 'gosub' or location[:2] == (mv_file, mv_item) ]
+        if locations:
+            show_symbol_locations(window, locations)
+        else:
+            window.status_message('No references found for ' + name)
+
+
+# Class: AccuTermIndexSymbolsCommand
+# Update the <SymbolIndex> with the local copies of all MV items.
+class AccuTermIndexSymbolsCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        def run():
+            index_mirror(self.window)
+            self.window.status_message('AccuTermClient symbol index updated')
+        sublime.set_timeout_async(run, 0)
+
+
+# Class: ItemDiff
+# State of a diff view comparing a local view with the item on the MV server (see <show_item_diff>).
+# Each hunk holds the region of the local view to replace, the lines from the MV server and the line numbers.
+class ItemDiff:
+    context_lines = 2
+
+    def __init__(self, view, server_text):
+        self.view = view
+        self.server_text = server_text
+        self.compare()
+
+    # Function: compare
+    # Compare the local view with the MV server copy and record the hunks.
+    def compare(self):
+        local_lines = split_lines(self.view.substr(sublime.Region(0, self.view.size())))
+        server_lines = split_lines(self.server_text)
+        offsets = [0] + list(itertools.accumulate(len(line) for line in local_lines))
+        self.change_count = self.view.change_count()
+        self.selected = set()
+        self.hunks = []
+        self.text = []
+        self.rows = []
+        for (i1, i2, j1, j2) in line_diff(local_lines, server_lines):
+            before = local_lines[max(0, i1 - self.context_lines):i1]
+            after = local_lines[i2:i2 + self.context_lines]
+            self.rows.append(len(self.text))
+            self.text.append(self.header(len(self.hunks), i1, i2, j1, j2))
+            self.text.extend( ' ' + line.rstrip('\n') for line in before )
+            self.text.extend( '-' + line.rstrip('\n') for line in local_lines[i1:i2] )
+            self.text.extend( '+' + line.rstrip('\n') for line in server_lines[j1:j2] )
+            self.text.extend( ' ' + line.rstrip('\n') for line in after )
+            self.hunks.append( (offsets[i1], offsets[i2], ''.join(server_lines[j1:j2]), i1, i2, j1, j2) )
+
+    def header(self, index, i1, i2, j1, j2):
+        return '@@ -' + str(i1 + 1) + ',' + str(i2 - i1) + ' +' + str(j1 + 1) + ',' + str(j2 - j1) + ' @@ ' + ('[x]' if index in self.selected else '[ ]')
+
+    # Function: render
+    # Returns the text of the diff view.
+    def render(self):
+        (mv_file, mv_item) = get_file_item(self.view)
+        title = 'Local copy (-) and MV server (+) of ' + str(mv_file) + ' ' + str(mv_item) + ': ' + str(len(self.hunks)) + ' changes\n'
+        if not self.hunks: return title + 'No differences\n'
+        return title + 'Enter selects a change, Apply Selected Changes updates the local copy\n\n' + '\n'.join(self.text) + '\n'
+
+    # Function: hunk_at
+    # Returns the index of the hunk shown on a row of the diff view, None if there is none.
+    def hunk_at(self, row):
+        index = bisect.bisect_right(self.rows, row - 3) - 1
+        return index if index >= 0 and self.hunks else None
+
+
+# State of open diff views, keyed by view id (see <ItemDiff>).
+diff_views = {}
+
+
+# Function: show_item_diff
+# Show the differences between a view and the item on the MV server in a diff view. Selected changes can be 
+# applied to the view as minimal edits with <AccuTermDiffApplyCommand>, keeping the rest of the local edits 
+# and the undo history.
+# 
+# Parameters:
+#   view - Sublime view object of the local copy.
+#   server_text - Item from the MV server converted with <decode_item>.
+# 
+# Returns:
+#   None
+def show_item_diff(view, server_text):
+    item_diff = ItemDiff(view, server_text)
+    window = view.window() if view.window() else sublime.active_window()
+    diff_view = window.new_file()
+    diff_view.set_name('Compare ' + view.name() if view.name() else 'Compare ' + os.path.basename(str(view.file_name())))
+    diff_view.set_scratch(True)
+    diff_view.set_syntax_file('Packages/Diff/Diff.sublime-syntax')
+    diff_view.settings().set('AccuTermClient_diff', True)
+    diff_view.settings().set('word_wrap', False)
+    diff_views[diff_view.id()] = item_diff
+    diff_view.run_command('accu_term_diff_render')
+
+
+# Class: AccuTermDiffRenderCommand
+# Redraw a diff view. Used internally by the diff commands.
+class AccuTermDiffRenderCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return self.view.id() in diff_views
+
+    def run(self, edit):
+        self.view.set_read_only(False)
+        self.view.replace(edit, sublime.Region(0, self.view.size()), diff_views[self.view.id()].render())
+        self.view.set_read_only(True)
+
+
+# Class: AccuTermDiffToggleCommand
+# Select or deselect the change under the cursor in a diff view, or all changes.
+class AccuTermDiffToggleCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return self.view.id() in diff_views
+
+    def run(self, edit, all=False):
+        item_diff = diff_views[self.view.id()]
+        if all:
+            item_diff.selected = set() if len(item_diff.selected) == len(item_diff.hunks) else set(range(len(item_diff.hunks)))
+            indexes = range(len(item_diff.hunks))
+        else:
+            index = item_diff.hunk_at(self.view.rowcol(self.view.sel()[0].begin())[0])
+            if index == None: return
+            item_diff.selected ^= set([index])
+            indexes = [index]
+        self.view.set_read_only(False)
+        for index in indexes:
+            (start, end, server_lines, i1, i2, j1, j2) = item_diff.hunks[index]
+            line = self.view.line(self.view.text_point(item_diff.rows[index] + 3, 0))
+            self.view.replace(edit, line, item_diff.header(index, i1, i2, j1, j2))
+        self.view.set_read_only(True)
+
+
+# Class: AccuTermDiffApplyCommand
+# Apply the selected changes in a diff view to the local copy.
+class AccuTermDiffApplyCommand(sublime_plugin.TextCommand):
+    def is_enabled(self):
+        return self.view.id() in diff_views
+
+    def run(self, edit):
+        item_diff = diff_views[self.view.id()]
+        if not item_diff.view.is_valid():
+            self.view.window().status_message('The local copy has been closed')
+            return
+        if item_diff.view.change_count() != item_diff.change_count:
+            self.view.window().status_message('The local copy has changed, comparing again')
+        elif not item_diff.selected:
+            self.view.window().status_message('No changes selected')
+            return
+        else:
+            hunks = [ item_diff.hunks[index][:3] for index in sorted(item_diff.selected) ]
+            item_diff.view.run_command('accu_term_apply_hunks', {"hunks": hunks})
+            self.view.window().status_message('Applied ' + str(len(hunks)) + ' changes from the MV server')
+        item_diff.compare()
+        self.view.run_command('accu_term_diff_render')
+
+
+# Class: AccuTermApplyHunksCommand
+# Replace regions of the current view, last region first so the earlier offsets stay valid. Used internally 
+# by <AccuTermDiffApplyCommand>.
+class AccuTermApplyHunksCommand(sublime_plugin.TextCommand):
+    # Function: run
+    # Parameters:
+    #   self - Sublime TextCommand instance.
+    #   edit - Sublime edit object.
+    #   hunks - List of [start, end, text].
+    def run(self, edit, hunks=[]):
+        for (start, end, text) in sorted(hunks, reverse=True):
+            self.view.replace(edit, sublime.Region(start, end), text)
+
+
+# Class: AccuTermCompareCommand
+# Compare the current view with the item on the MV server (see <show_item_diff>).
+class AccuTermCompareCommand(sublime_plugin.TextCommand):
+    def run(self, edit):
+        (mv_file, mv_item) = get_file_item(self.view)
+        mv_svr = connect()
+        if mv_svr.IsConnected():
+            if bool( mv_svr.ItemExists(mv_file, mv_item) ):
+                data = mv_svr.Readitem(mv_file, mv_item, 0, 0, 0, 0)
+                if check_error_message(self.view.window(), mv_svr, ''): show_item_diff(self.view, decode_item(data))
+            else:
+                log_output(self.view.window(), mv_file + ' ' + mv_item + ' not found.')
+            mv_svr.Disconnect()
@@ -0,0 +1,71 @@
+# Package: AccuTermClient
+# Conversion between Sublime text and MV items. Kept apart from the plugin (it does not import sublime) so it 
+# can be used and tested outside Sublime.
+
+
+# MultiValue delimiters.
+AM  = '\xFE' # Attribute mark
+VM  = '\xFD' # Value mark
+SVM = '\xFC' # Subvalue mark
+
+# Translation tables used by <mv_translate>. Each table is a sequence of (old, new) pairs applied in order.
+# 
+#   ENCODE_TABLE - Sublime text to MV item. Lines become attributes.
+#   DECODE_TABLE - MV item (as returned by Readitem) to Sublime text. Attributes become lines.
+#   OUTPUT_TABLE - Output of Execute to Sublime text. Escape sequences are removed.
+#   DISPLAY_TABLE - Value and subvalue marks to the characters conventionally used to display them.
+# 
+# Value and subvalue marks pass through unchanged in both directions, so decode_item(encode_item(text)) == text 
+# for any text without attribute marks or carriage returns, and encode_item(decode_item(data)) == data for 
+# any item delimited by attribute marks without line breaks.
+ENCODE_TABLE = (('\n', AM),)
+DECODE_TABLE = (('\r\n', '\n'), ('\r', '\n'), (AM, '\n'))
+OUTPUT_TABLE = (('\x1b', ''), ('\r\n', '\n'))
+DISPLAY_TABLE = ((VM, ']'), (SVM, '\\'))
+
+
+# Function: mv_translate
+# Converts text with a translation table. str.replace is used rather than str.translate because replace
+# scans at memory speed while translate falls back to a per character lookup once the text contains
+# mark characters. Pairs that do not occur are skipped after a search, which is much cheaper than a replace 
+# that copies the text, so an item normally costs a single pass.
+# 
+# Parameters:
+#   text - String to convert.
+#   table - Sequence of (old, new) pairs (see <ENCODE_TABLE>).
+# 
+# Returns:
+#   string - Converted text.
+def mv_translate(text, table):
+    for (old, new) in table:
+        if old in text: text = text.replace(old, new)
+    return text
+
+
+# Function: encode_item
+# Converts the text of a Sublime view to an MV item.
+def encode_item(text):
+    return mv_translate(text, ENCODE_TABLE)
+
+
+# Function: decode_item
+# Converts an MV item to text for a Sublime view.
+def decode_item(data):
+    return mv_translate(data, DECODE_TABLE)
+
+
+# Function: item_matches
+# Returns True if decode_item(data) == text. When the item uses one kind of line break the text is converted 
+# to match the item instead, which avoids the slower conversion of CRLF line breaks, the item is only decoded 
+# if that comparison fails.
+def item_matches(data, text):
+    if '\r' not in text and AM not in text:
+        line_end = data.find('\n')
+        if line_end == -1:
+            expected = encode_item(text)
+        elif line_end > 0 and data[line_end - 1] == '\r':
+            expected = text.replace('\n', '\r\n')
+        else:
+            expected = text
+        if expected == data: return True
+    return decode_item(data) == text
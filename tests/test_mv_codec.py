@@ -0,0 +1,54 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mv_codec import AM, VM, SVM, DISPLAY_TABLE, OUTPUT_TABLE, decode_item, encode_item, item_matches, mv_translate
+
+
+class MvCodecTest(unittest.TestCase):
+    trials = 2000
+
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def random_text(self, alphabet):
+        return ''.join(self.random.choice(alphabet) for _ in range(self.random.randint(0, 64)))
+
+    def test_text_round_trip(self):
+        alphabet = ['a', 'Z', '0', ' ', '"', '\\', ']', '\t', '\n', '\n', VM, SVM, '\xe9', '€']
+        for _ in range(self.trials):
+            text = self.random_text(alphabet)
+            self.assertEqual(decode_item(encode_item(text)), text)
+
+    def test_item_round_trip(self):
+        alphabet = ['a', 'Z', '0', ' ', '"', '\\', ']', '\t', AM, AM, VM, SVM, '\xe9', '€']
+        for _ in range(self.trials):
+            data = self.random_text(alphabet)
+            self.assertEqual(encode_item(decode_item(data)), data)
+
+    def test_item_matches(self):
+        alphabet = ['a', 'Z', ' ', '\r', '\n', '\r\n', '\r\n', AM, VM, '\xe9']
+        for _ in range(self.trials):
+            data = self.random_text(alphabet)
+            texts = [decode_item(data), self.random_text(alphabet), decode_item(data) + 'a', decode_item(data)[1:]]
+            for text in texts:
+                self.assertEqual(item_matches(data, text), decode_item(data) == text, (data, text))
+
+    def test_encode_item(self):
+        self.assertEqual(encode_item('A\nB' + VM + 'C\n'), 'A' + AM + 'B' + VM + 'C' + AM)
+
+    def test_decode_item_line_endings(self):
+        self.assertEqual(decode_item('A\r\nB\rC' + AM + 'D'), 'A\nB\nC\nD')
+
+    def test_output_table(self):
+        self.assertEqual(mv_translate('\x1bA\r\nB', OUTPUT_TABLE), 'A\nB')
+
+    def test_display_table(self):
+        self.assertEqual(mv_translate('A' + VM + 'B' + SVM + 'C', DISPLAY_TABLE), 'A]B\\C')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_diff import edit_script, line_diff, split_lines
+
+
+def apply_hunks(a, b, hunks):
+    result = list(a)
+    for (i1, i2, j1, j2) in sorted(hunks, reverse=True):
+        result[i1:i2] = b[j1:j2]
+    return result
+
+
+def edit_count(hunks):
+    return sum( (i2 - i1) + (j2 - j1) for (i1, i2, j1, j2) in hunks )
+
+
+def lcs_length(a, b):
+    previous = [0] * (len(b) + 1)
+    for i in range(len(a)):
+        current = [0]
+        for j in range(len(b)):
+            current.append(previous[j] + 1 if a[i] == b[j] else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+class TextDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def random_lines(self, alphabet, size):
+        return [ self.random.choice(alphabet) for _ in range(self.random.randint(0, size)) ]
+
+    def edited(self, lines, alphabet, edits):
+        lines = list(lines)
+        for _ in range(edits):
+            index = self.random.randint(0, len(lines))
+            operation = self.random.choice('dir')
+            if operation == 'i' or index == len(lines):
+                lines.insert(index, self.random.choice(alphabet))
+            elif operation == 'd':
+                del lines[index]
+            else:
+                lines[index] = self.random.choice(alphabet)
+        return lines
+
+    def test_split_lines(self):
+        for text in ['', 'a', 'a\n', 'a\nb', 'a\n\nb\n', '\n']:
+            self.assertEqual(''.join(split_lines(text)), text)
+        self.assertEqual(split_lines('a\nb\n'), ['a\n', 'b\n'])
+
+    def test_edit_script_is_minimal(self):
+        for _ in range(1000):
+            a = self.random_lines('xyz', 30)
+            b = self.random_lines('xyz', 30)
+            hunks = []
+            self.assertTrue(edit_script(a, 0, len(a), b, 0, len(b), hunks, [10 ** 9]))
+            self.assertEqual(apply_hunks(a, b, hunks), b)
+            self.assertEqual(edit_count(hunks), len(a) + len(b) - 2 * lcs_length(a, b))
+
+    def test_edit_script_budget(self):
+        a = ['x'] * 1000
+        b = ['y'] * 1000
+        self.assertFalse(edit_script(a, 0, len(a), b, 0, len(b), [], [1000]))
+
+    def test_line_diff_applies(self):
+        alphabets = ['xy', 'xyz', [str(n) for n in range(50)], [str(n) for n in range(5000)]]
+        for _ in range(300):
+            alphabet = self.random.choice(alphabets)
+            a = self.random_lines(alphabet, 400)
+            b = self.edited(a, alphabet, self.random.randint(0, 20)) if self.random.random() < 0.8 else self.random_lines(alphabet, 400)
+            self.assertEqual(apply_hunks(a, b, line_diff(a, b)), b)
+
+    def test_line_diff_repeated_lines(self):
+        a = ['x\n', 'y\n'] * 15000
+        b = list(a)
+        for _ in range(50):
+            b.insert(self.random.randint(0, len(b)), self.random.choice(['x\n', 'y\n', 'z\n']))
+        hunks = line_diff(a, b)
+        self.assertEqual(apply_hunks(a, b, hunks), b)
+        self.assertEqual(edit_count(hunks), len(b) - len(a))
+
+
+if __name__ == '__main__':
+    unittest.main()
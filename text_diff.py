@@ -0,0 +1,157 @@
+# Package: AccuTermClient
+# Line diff used to compare a local copy with the item on the MV server (see <ItemDiff>). Kept apart from the 
+# plugin (it does not import sublime) so it can be tested outside Sublime.
+
+import bisect
+import collections
+import difflib
+
+
+# Function: split_lines
+# Split text into lines, keeping the line endings so the lines join back into the same text.
+def split_lines(text):
+    lines = [ line + '\n' for line in text.split('\n') ]
+    lines[-1] = lines[-1][:-1]
+    if lines[-1] == '': lines.pop()
+    return lines
+
+
+# Function: line_diff
+# Compare two lists of lines. Lines that occur once in both lists are used as anchors (the longest run of 
+# anchors in the same order is kept) and the lines between anchors are compared recursively, ranges without
+# anchors are compared with difflib or <edit_script>. Large items with a few changes are compared quickly.
+# 
+# Small ranges without anchors are compared with difflib. Large ones use <edit_script>, which shares 
+# diff_edit_budget between all the ranges of one comparison. A large range that would exceed the budget is 
+# shown as one hunk, so items that differ almost everywhere (ex. two unrelated items of 20,000 lines) are 
+# compared in under a second but their changes are not broken down.
+# 
+# Parameters:
+#   local_lines - List of lines in the local copy.
+#   server_lines - List of lines in the MV server copy.
+# 
+# Returns:
+#   list - (i1, i2, j1, j2) for each change, local_lines[i1:i2] should be replaced by server_lines[j1:j2].
+def line_diff(local_lines, server_lines):
+    hunks = []
+    diff_range(local_lines, 0, len(local_lines), server_lines, 0, len(server_lines), hunks, [diff_edit_budget])
+    return hunks
+
+
+def diff_range(a, alo, ahi, b, blo, bhi, hunks, budget):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]: (alo, blo) = (alo + 1, blo + 1)
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]: (ahi, bhi) = (ahi - 1, bhi - 1)
+    if alo == ahi or blo == bhi:
+        if alo < ahi or blo < bhi: hunks.append( (alo, ahi, blo, bhi) )
+        return
+    anchors = unique_anchors(a, alo, ahi, b, blo, bhi)
+    if anchors:
+        for (i, j) in anchors + [(ahi, bhi)]:
+            diff_range(a, alo, i, b, blo, j, hunks, budget)
+            (alo, blo) = (i + 1, j + 1)
+    elif (ahi - alo) * (bhi - blo) <= 1000000:
+        matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], False)
+        hunks.extend( (i1 + alo, i2 + alo, j1 + blo, j2 + blo) for (tag, i1, i2, j1, j2) in matcher.get_opcodes() if tag != 'equal' )
+    elif not edit_script(a, alo, ahi, b, blo, bhi, hunks, budget):
+        # The range differs too much to be compared in time, difflib would take seconds on it as well.
+        hunks.append( (alo, ahi, blo, bhi) )
+
+
+# Line comparisons <edit_script> may spend on one comparison (see <line_diff>), about half a second.
+diff_edit_budget = 1500000
+
+
+# Function: edit_script
+# Find the fewest lines to delete and insert to turn a[alo:ahi] into b[blo:bhi] (Myers' O(ND) algorithm). Used 
+# for large ranges without anchors, such as data items made of repeated lines, where difflib would junk the 
+# common lines and return a single large hunk. The work grows with the square of the number of changed lines,
+# so the search is not started when the lines the ranges do not have in common rule it out, and is abandoned 
+# once the budget is used up.
+# 
+# Parameters:
+#   budget - List holding the number of line comparisons left, reduced by the comparisons made.
+# 
+# Returns:
+#   bool - True if the changes were added to hunks, False if the ranges differ too much.
+def edit_script(a, alo, ahi, b, blo, bhi, hunks, budget):
+    (n, m) = (ahi - alo, bhi - blo)
+    common = sum( (collections.Counter(a[alo:ahi]) & collections.Counter(b[blo:bhi])).values() )
+    if (n + m - 2 * common) ** 2 // 2 > budget[0]: return False
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    trace = []
+    work = 0
+    for d in range(n + m + 1):
+        if work > budget[0]:
+            budget[0] = 0
+            return False
+        trace.append(v[offset - d:offset + d + 1])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[alo + x] == b[blo + y]: (x, y) = (x + 1, y + 1)
+            work += x - start + 1
+            v[offset + k] = x
+            if x >= n and y >= m: break
+        else:
+            continue
+        break
+    budget[0] -= work
+    # Walk back through the furthest points of each round, collecting each deleted or inserted line.
+    edits = []
+    (x, y) = (n, m)
+    for d in range(len(trace) - 1, 0, -1):
+        previous = trace[d] # Furthest x of each diagonal after round d - 1, indexed from -d.
+        k = x - y
+        if k == -d or (k != d and previous[k - 1 + d] < previous[k + 1 + d]):
+            (x, y) = (previous[k + 1 + d], previous[k + 1 + d] - k - 1)
+            edits.append( (x, y, x, y + 1) )
+        else:
+            (x, y) = (previous[k - 1 + d], previous[k - 1 + d] - k + 1)
+            edits.append( (x, y, x + 1, y) )
+    change = None
+    for (i1, j1, i2, j2) in reversed(edits):
+        if change and change[1] == i1 and change[3] == j1:
+            change[1:4:2] = [i2, j2]
+        else:
+            if change: hunks.append( (change[0] + alo, change[1] + alo, change[2] + blo, change[3] + blo) )
+            change = [i1, i2, j1, j2]
+    if change: hunks.append( (change[0] + alo, change[1] + alo, change[2] + blo, change[3] + blo) )
+    return True
+
+
+# Function: unique_anchors
+# Returns the longest list of (i, j) in increasing order where a[i] == b[j] and the line occurs once in each range.
+def unique_anchors(a, alo, ahi, b, blo, bhi):
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.setdefault(a[i], [0, 0, i, 0])
+        entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j], None)
+        if entry != None:
+            entry[1] += 1
+            entry[3] = j
+    pairs = sorted( (entry[2], entry[3]) for entry in counts.values() if entry[0] == 1 and entry[1] == 1 )
+    tails = []
+    tail_indexes = []
+    previous = []
+    for (index, (i, j)) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        previous.append(tail_indexes[k - 1] if k > 0 else -1)
+        if k == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[k] = j
+            tail_indexes[k] = index
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else -1
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]